@@ -0,0 +1,58 @@
+"""
+Микробенчмарк сборки клавиатур на одно обновление.
+
+Сравнивает сборку разметки с нуля (InlineKeyboardBuilder + json.dumps на каждую кнопку)
+с предсобранными и LRU-кэшированными клавиатурами из keyboards.inline.
+
+Запуск: python -m benchmarks.keyboards
+"""
+import timeit
+
+from keyboards.inline import (
+    _build_main_menu_kb, _build_back_to_main_menu_kb,
+    main_menu_kb, back_to_main_menu_kb, wallet_menu_kb, confirm_delete_kb, is_shared_expense_kb
+)
+
+NUMBER = 20_000
+WALLET_IDS = range(1, 51)
+
+
+def _per_call_us(func, number: int = NUMBER) -> float:
+    return min(timeit.repeat(func, number=number, repeat=5)) / number * 1_000_000
+
+
+def _wallet_keyboards(builders):
+    wallet_menu, confirm_delete, is_shared_expense = builders
+
+    def run():
+        for wallet_id in WALLET_IDS:
+            wallet_menu(wallet_id, wallet_id % 2 == 0)
+            confirm_delete(wallet_id)
+            is_shared_expense(wallet_id)
+
+    return run
+
+
+def main():
+    cases = [
+        ("main_menu_kb", _build_main_menu_kb, main_menu_kb, NUMBER),
+        ("back_to_main_menu_kb", _build_back_to_main_menu_kb, back_to_main_menu_kb, NUMBER),
+        (
+            f"wallet keyboards x{len(WALLET_IDS)} wallets",
+            _wallet_keyboards((wallet_menu_kb.__wrapped__, confirm_delete_kb.__wrapped__,
+                               is_shared_expense_kb.__wrapped__)),
+            _wallet_keyboards((wallet_menu_kb, confirm_delete_kb, is_shared_expense_kb)),
+            NUMBER // len(WALLET_IDS),
+        ),
+    ]
+
+    print(f"{'клавиатура':<36}{'сборка, мкс':>14}{'кэш, мкс':>12}{'ускорение':>12}")
+    for title, build, cached, number in cases:
+        cached()
+        built_us = _per_call_us(build, number)
+        cached_us = _per_call_us(cached, number)
+        print(f"{title:<36}{built_us:>14.2f}{cached_us:>12.3f}{built_us / cached_us:>11.0f}x")
+
+
+if __name__ == '__main__':
+    main()
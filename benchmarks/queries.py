@@ -0,0 +1,240 @@
+"""
+Бюджет SQL-запросов на хендлер.
+
+Схема поднимается в отдельной локальной БД, в неё записываются счета разного размера,
+а через диспетчер прогоняются синтетические нажатия кнопок. Каждый хендлер получает
+холодные кэши (категории, «Мой итог»). Запросы считает событие SQLAlchemy
+before_cursor_execute на всех движках, то есть и на основной БД, и на репликах. Скрипт
+завершается с кодом 1, если хендлер выполнил больше запросов, чем указано в BUDGETS,
+или если число запросов зависит от размера счёта (признак N+1). В этом случае он
+печатает выполненные запросы.
+
+БД берётся из обычных настроек DB_*. Её имя должно оканчиваться на «_bench», потому что
+схема public пересоздаётся при каждом запуске.
+
+Запуск: DB_NAME=wallet_bot_bench python -m benchmarks.queries
+"""
+import asyncio
+import json
+import os
+import random
+import sys
+from dataclasses import dataclass
+from datetime import datetime, timedelta, timezone
+from decimal import Decimal
+from typing import Callable
+
+from sqlalchemy import event, text
+from sqlalchemy.engine import Engine
+
+# Бот в сеть не ходит, но без токена настройки не загрузятся.
+os.environ.setdefault("BOT_TOKEN", "0")
+os.environ.setdefault("PRELOAD_MODULES", "false")
+
+USER_ID = 1
+CHAT_ID = 1
+MEMBER_IDS = (USER_ID, 2, 3)
+# Число трат в счетах; пополнений в десять раз меньше.
+WALLET_SIZES = {"small": 10, "medium": 1_000, "large": 20_000}
+HISTORY_DAYS = 120
+CATEGORIES = ("Продукты", "Транспорт", "Кафе", "Жильё", "Подписки", "Здоровье", "Подарки", "Одежда")
+
+BENCH_USER = {"user_id": USER_ID, "first_name": "Bench", "is_bot": False, "last_activity_time": 0}
+
+
+@dataclass(frozen=True)
+class Case:
+    name: str
+    budget: int
+    payload: Callable[[int], dict]
+    search_query: str | None = None
+
+
+# Бюджет — число SQL-запросов за одно обновление, включая запросы через read_query().
+BUDGETS = [
+    Case("back_to_main_menu", 0, lambda w: {"menu": "back_to_main"}),
+    Case("show_user_wallets", 2, lambda w: {"menu": "my_wallets"}),
+    Case("show_my_total", 1, lambda w: {"menu": "my_total"}),
+    Case("open_wallet_menu", 1, lambda w: {"action": "open_wallet", "wallet_id": w}),
+    Case("wallet_stats_handler", 3, lambda w: {"action": "stats", "wallet_id": w}),
+    Case("wallet_period_stats", 3, lambda w: {"action": "stats_period", "period": "month", "wallet_id": w}),
+    Case("search_page", 2, lambda w: {"action": "search_page", "wallet_id": w, "page": 1}, search_query="кафе"),
+    Case("show_my_incomes", 3, lambda w: {"action": "my_incomes", "wallet_id": w}),
+    Case("show_my_expenses", 3, lambda w: {"action": "my_expenses", "wallet_id": w}),
+    Case("show_my_expenses_page", 3, lambda w: {"action": "my_expenses", "wallet_id": w, "page": 1}),
+    Case("show_recurring", 2, lambda w: {"action": "recurring", "wallet_id": w}),
+    Case("add_expense_start", 2, lambda w: {"action": "add_expense", "wallet_id": w}),
+    Case("download_full_stats", 11, lambda w: {"action": "download_full_stats", "wallet_id": w}),
+]
+
+
+class QueryCounter:
+    """Собирает SQL всех движков, пока активен контекст."""
+
+    def __init__(self):
+        self.statements: list[str] = []
+
+    def _on_execute(self, conn, cursor, statement, parameters, context, executemany):
+        self.statements.append(" ".join(statement.split()))
+
+    def __enter__(self) -> "QueryCounter":
+        event.listen(Engine, "before_cursor_execute", self._on_execute)
+        return self
+
+    def __exit__(self, *exc):
+        event.remove(Engine, "before_cursor_execute", self._on_execute)
+
+
+def _callback_update(payload: dict) -> dict:
+    return {
+        "update_type": "message_callback",
+        "timestamp": 0,
+        "callback": {"timestamp": 0, "callback_id": "query-budget", "payload": json.dumps(payload), "user": BENCH_USER},
+        "message": {
+            "sender": BENCH_USER,
+            "recipient": {"chat_id": CHAT_ID, "chat_type": "dialog"},
+            "timestamp": 0,
+            "body": {"mid": "mid.query-budget", "seq": 0, "text": ""},
+        },
+    }
+
+
+async def _reset_schema():
+    from database.db import engine, init_db
+
+    async with engine.begin() as conn:
+        await conn.execute(text("DROP SCHEMA public CASCADE"))
+        await conn.execute(text("CREATE SCHEMA public"))
+    await init_db()
+
+
+async def _seed() -> dict[str, int]:
+    """Счета WALLET_SIZES с историей за HISTORY_DAYS дней и снимками журнала; возвращает их ID."""
+    from database.db import async_session_maker
+    from database.imports import ensure_import_partitions, import_ledger
+    from database.ledger import write_checkpoint
+    from database.models import Wallet, WalletMember
+    from database.users import user_registry
+    from utils.csv_import import ParsedImport
+
+    for user_id in MEMBER_IDS:
+        await user_registry.register(user_id, None, "Bench" if user_id == USER_ID else f"Member {user_id}")
+
+    rng = random.Random(0)
+    now = datetime.now(timezone.utc).replace(tzinfo=None)
+    wallet_ids = {}
+    for size_name, size in WALLET_SIZES.items():
+        async with async_session_maker() as session:
+            async with session.begin():
+                wallet = Wallet(name=f"Счёт {size_name}", owner_id=USER_ID, balance=Decimal(0))
+                session.add(wallet)
+                await session.flush()
+                session.add_all(WalletMember(wallet_id=wallet.id, user_id=user_id) for user_id in MEMBER_IDS)
+
+        def moment():
+            return now - timedelta(days=rng.uniform(0, HISTORY_DAYS))
+
+        parsed = ParsedImport(
+            expenses=[
+                (wallet.id, rng.choice(MEMBER_IDS), rng.choice(CATEGORIES), f"Место {i % 50}",
+                 Decimal(rng.randint(100, 500_000)) / 100, rng.random() < 0.3, None, moment())
+                for i in range(size)
+            ],
+            incomes=[
+                (wallet.id, rng.choice(MEMBER_IDS), Decimal(rng.randint(10_000, 5_000_000)) / 100,
+                 "Пополнение", moment())
+                for _ in range(max(1, size // 10))
+            ]
+        )
+        # Как в хендлере импорта: секции создаются до транзакции импорта.
+        await ensure_import_partitions(parsed)
+        async with async_session_maker() as session:
+            async with session.begin():
+                session.add(wallet)
+                await import_ledger(session, wallet, parsed)
+        wallet_ids[size_name] = wallet.id
+
+        async with async_session_maker() as session:
+            async with session.begin():
+                await write_checkpoint(session, wallet_ids[size_name])
+    return wallet_ids
+
+
+async def _measure(wallet_ids: dict[str, int]) -> int:
+    from maxapi import Bot
+    from maxapi.methods.types.getted_updates import get_update_model
+    from database.categories import category_index
+    from database.dashboard import net_positions
+    from main import build_dispatcher
+    from states.storage import fsm_storage
+
+    replies = []
+
+    async def reply(*args, **kwargs):
+        replies.append(kwargs.get("text"))
+
+    async def get_chat_by_id(*args, **kwargs):
+        return None
+
+    bot = Bot("0")
+    bot.edit_message = reply
+    bot.send_message = reply
+    bot.send_callback = reply
+    bot.get_chat_by_id = get_chat_by_id
+    dp, _ = await build_dispatcher()
+    dp.bot = bot
+    dp.routers += [dp]
+
+    failures = 0
+    print(f"{'хендлер':<24}{'бюджет':>8}" + "".join(f"{name:>10}" for name in wallet_ids))
+    for case in BUDGETS:
+        counts = {}
+        for size_name, wallet_id in wallet_ids.items():
+            category_index._counts.clear()
+            net_positions._positions.clear()
+            context = fsm_storage.get(CHAT_ID, USER_ID)
+            await context.clear()
+            if case.search_query is not None:
+                await context.update_data(search_query=case.search_query, wallet_id=wallet_id)
+
+            update = await get_update_model(_callback_update(case.payload(wallet_id)), bot)
+            replies.clear()
+            with QueryCounter() as counter:
+                await dp.handle(update)
+            if not replies:
+                print(f"{case.name}: хендлер не ответил на счёте {size_name} (ошибка в логе выше)")
+                failures += 1
+            counts[size_name] = counter
+
+        line = f"{case.name:<24}{case.budget:>8}" + "".join(f"{len(c.statements):>10}" for c in counts.values())
+        over = [name for name, c in counts.items() if len(c.statements) > case.budget]
+        varies = len({len(c.statements) for c in counts.values()}) > 1
+        if over or varies:
+            failures += 1
+            line += "  ← " + ("бюджет превышен" if over else "зависит от размера счёта")
+        print(line)
+        if over or varies:
+            worst = max(counts.values(), key=lambda c: len(c.statements))
+            for statement in worst.statements:
+                print(f"      {statement[:160]}")
+    return failures
+
+
+async def _run() -> int:
+    from config import settings
+
+    if not settings.db_name.endswith("_bench"):
+        print(f"Имя БД «{settings.db_name}» не оканчивается на «_bench»: схема пересоздаётся, "
+              f"запустите с DB_NAME=<имя>_bench")
+        return 2
+    await _reset_schema()
+    wallet_ids = await _seed()
+    failures = await _measure(wallet_ids)
+    if failures:
+        print(f"Бюджет запросов нарушен: {failures}")
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(asyncio.run(_run()))
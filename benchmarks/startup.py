@@ -0,0 +1,138 @@
+"""
+Бенчмарк холодного старта: от первого импорта до обработки первого обновления.
+
+Каждый прогон — отдельный процесс интерпретатора: импорт main, сборка диспетчера с
+middleware и хендлерами, затем одно синтетическое нажатие «Назад в меню». Сетевые
+методы бота подменены заглушками, пользователь заранее помечен как зарегистрированный,
+а хендлер не обращается к БД, поэтому Postgres и токен не нужны.
+
+С STARTUP_WITH_DB=1 каждый прогон, как main(), сначала вызывает init_db() на БД из
+настроек DB_*. Это время измеряется отдельно, в бюджет первого обновления не входит и
+сравнивается со своим порогом INIT_DB_BUDGET_SECONDS (по умолчанию 0.5 с). Схема БД
+должна быть уже актуальной (например, после benchmarks.queries), иначе первый прогон
+применит миграции.
+
+Запуск: python -m benchmarks.startup
+Порог задаётся STARTUP_BUDGET_SECONDS (по умолчанию 1.5 с); при превышении медианы
+скрипт завершается с кодом 1.
+"""
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+RUNS = 5
+DEFAULT_BUDGET_SECONDS = 1.5
+DEFAULT_INIT_DB_BUDGET_SECONDS = 0.5
+USER_ID = 1
+CHAT_ID = 1
+
+BENCH_USER = {"user_id": USER_ID, "first_name": "Bench", "is_bot": False, "last_activity_time": 0}
+
+CALLBACK_UPDATE = {
+    "update_type": "message_callback",
+    "timestamp": 0,
+    "callback": {
+        "timestamp": 0,
+        "callback_id": "startup-benchmark",
+        "payload": '{"menu": "back_to_main"}',
+        "user": BENCH_USER,
+    },
+    "message": {
+        "sender": BENCH_USER,
+        "recipient": {"chat_id": CHAT_ID, "chat_type": "dialog"},
+        "timestamp": 0,
+        "body": {"mid": "mid.startup", "seq": 0, "text": ""},
+    },
+}
+
+
+async def _first_update(with_db: bool) -> tuple[float, float]:
+    """Время до первого обновления без init_db() и время самого init_db() (0, если без БД)."""
+    started = time.perf_counter()
+
+    from maxapi import Bot
+    from maxapi.methods.types.getted_updates import get_update_model
+    from main import build_dispatcher
+    from database.db import init_db
+    from database.users import user_registry
+
+    init_seconds = 0.0
+    if with_db:
+        init_started = time.perf_counter()
+        await init_db()
+        init_seconds = time.perf_counter() - init_started
+
+    handled = []
+
+    async def edit_message(*args, **kwargs):
+        handled.append(time.perf_counter())
+
+    async def get_chat_by_id(*args, **kwargs):
+        return None
+
+    bot = Bot("0")
+    bot.edit_message = edit_message
+    bot.get_chat_by_id = get_chat_by_id
+    dp, _ = await build_dispatcher()
+    # То же, что делает Dispatcher перед поллингом, но без запросов к API.
+    dp.bot = bot
+    dp.routers += [dp]
+
+    event = await get_update_model(CALLBACK_UPDATE, bot)
+    user_registry._known[USER_ID] = (None, "Bench")
+    await dp.handle(event)
+
+    if not handled:
+        raise RuntimeError("Синтетическое обновление не было обработано")
+    return handled[0] - started - init_seconds, init_seconds
+
+
+def _child():
+    import asyncio
+    first_update, init_seconds = asyncio.run(_first_update("--with-db" in sys.argv))
+    print(first_update, init_seconds)
+
+
+def _run_once(with_db: bool) -> tuple[float, float]:
+    env = {"BOT_TOKEN": "0", "DB_PASSWORD": "", **os.environ, "PRELOAD_MODULES": "false"}
+    result = subprocess.run(
+        [sys.executable, "-m", "benchmarks.startup", "--child", *(["--with-db"] if with_db else [])],
+        env=env, capture_output=True, text=True, check=True
+    )
+    first_update, init_seconds = result.stdout.strip().splitlines()[-1].split()
+    return float(first_update), float(init_seconds)
+
+
+def main() -> int:
+    budget = float(os.environ.get("STARTUP_BUDGET_SECONDS", DEFAULT_BUDGET_SECONDS))
+    init_budget = float(os.environ.get("INIT_DB_BUDGET_SECONDS", DEFAULT_INIT_DB_BUDGET_SECONDS))
+    with_db = os.environ.get("STARTUP_WITH_DB", "").lower() in ("1", "true", "yes")
+    runs = [_run_once(with_db) for _ in range(RUNS)]
+    timings = [first_update for first_update, _ in runs]
+    median = statistics.median(timings)
+
+    failed = False
+    print("прогоны, с: " + ", ".join(f"{t:.3f}" for t in timings))
+    print(f"медиана до первого обновления: {median:.3f} с (бюджет {budget:.3f} с)")
+    if median > budget:
+        print("Бюджет времени старта превышен")
+        failed = True
+
+    if with_db:
+        init_timings = [init_seconds for _, init_seconds in runs]
+        init_median = statistics.median(init_timings)
+        print("init_db, с: " + ", ".join(f"{t:.3f}" for t in init_timings))
+        print(f"медиана init_db: {init_median:.3f} с (бюджет {init_budget:.3f} с)")
+        if init_median > init_budget:
+            print("Бюджет времени init_db превышен")
+            failed = True
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    if "--child" in sys.argv:
+        _child()
+    else:
+        sys.exit(main())
@@ -4,6 +4,14 @@ from pydantic_settings import BaseSettings, SettingsConfigDict
 
 class Settings(BaseSettings):
     bot_token: str = Field()
+    # Импорт тяжёлых модулей (ReportLab) в фоне сразу после запуска поллинга.
+    preload_modules: bool = Field(default=True)
+
+    # Незавершённые мастера (FSM) забываются через fsm_ttl секунд простоя; контекстов
+    # в памяти не больше fsm_max_entries, лишние вытесняются по давности использования.
+    fsm_ttl: float = Field(default=1800.0)
+    fsm_max_entries: int = Field(default=10000)
+    fsm_sweep_interval: float = Field(default=60.0)
 
     db_user: str = Field(default="postgres")
     db_password: str = Field()
@@ -11,6 +19,26 @@ class Settings(BaseSettings):
     db_port: int = Field(default=5432)
     db_name: str = Field(default="wallet_bot")
 
+    db_pool_size: int = Field(default=10)
+    db_max_overflow: int = Field(default=20)
+    db_statement_cache_size: int = Field(default=100)
+
+    # incomes/expenses секционированы по месяцам; секции старше db_archive_after_months
+    # отсоединяются в архив (0 — архивация выключена).
+    db_partition_months_ahead: int = Field(default=2)
+    db_archive_after_months: int = Field(default=0)
+
+    # Реплики для отчётов: JSON-список "host" или "host:port", например ["replica1", "replica2:5433"].
+    db_replica_hosts: list[str] = Field(default=[])
+    db_replica_pool_size: int = Field(default=5)
+    db_replica_max_overflow: int = Field(default=10)
+    db_replica_statement_cache_size: int = Field(default=100)
+    db_replica_max_lag: float = Field(default=5.0)
+    db_replica_check_interval: float = Field(default=10.0)
+    # Секунды на подключение к реплике и на один запрос к ней; после ошибки отчёт читается с основной БД.
+    db_replica_connect_timeout: float = Field(default=2.0)
+    db_replica_command_timeout: float = Field(default=60.0)
+
     model_config = SettingsConfigDict(
         env_file=".env",
         env_file_encoding="utf-8",
@@ -22,5 +50,15 @@ class Settings(BaseSettings):
     def database_url(self) -> str:
         return f"postgresql+asyncpg://{self.db_user}:{self.db_password}@{self.db_host}:{self.db_port}/{self.db_name}"
 
+    @property
+    def replica_database_urls(self) -> list[str]:
+        urls = []
+        for replica in self.db_replica_hosts:
+            host, _, port = replica.partition(":")
+            urls.append(
+                f"postgresql+asyncpg://{self.db_user}:{self.db_password}@{host}:{port or self.db_port}/{self.db_name}"
+            )
+        return urls
+
 
 settings = Settings()
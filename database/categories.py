@@ -0,0 +1,120 @@
+import difflib
+from collections import OrderedDict
+
+from sqlalchemy import select, text
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.ext.asyncio import AsyncSession, AsyncConnection
+
+from database.models import ExpenseCategoryCount
+from database.transactions import after_commit
+
+CATEGORY_CACHE_WALLETS = 1024
+TOP_CATEGORIES = 6
+# Насколько близко (0..1) ввод должен совпасть с существующей категорией, чтобы считаться ей.
+CATEGORY_MATCH_CUTOFF = 0.85
+
+# Частоты по всей истории, включая архивные секции: дневные агрегаты хранят число трат.
+BACKFILL_CATEGORY_COUNTS = text("""
+    INSERT INTO expense_category_counts (wallet_id, category, count)
+    SELECT wallet_id, category, SUM(count) FROM expense_daily_rollups
+    GROUP BY wallet_id, category
+    HAVING SUM(count) > 0
+    ON CONFLICT DO NOTHING
+""")
+
+
+def category_key(category: str) -> str:
+    """Ключ сравнения: регистр, «ё» и лишние пробелы не различаются."""
+    return " ".join(category.lower().replace("ё", "е").split())
+
+
+async def backfill_category_counts(conn: AsyncConnection):
+    await conn.execute(BACKFILL_CATEGORY_COUNTS)
+
+
+class CategoryIndex:
+    """
+    Частоты категорий трат по счетам.
+
+    В БД частоты лежат в expense_category_counts и меняются в той же транзакции, что и
+    трата. В памяти хранятся частоты недавно использованных счетов (LRU): они загружаются
+    одним запросом при первом обращении и дальше обновляются теми же вызовами record()
+    после фиксации транзакции, так что откаченная трата кэш не меняет.
+    """
+
+    def __init__(self, max_wallets: int = CATEGORY_CACHE_WALLETS):
+        self.max_wallets = max_wallets
+        self._counts: OrderedDict[int, dict[str, int]] = OrderedDict()
+
+    async def _wallet_counts(self, session: AsyncSession, wallet_id: int) -> dict[str, int]:
+        counts = self._counts.get(wallet_id)
+        if counts is None:
+            rows = await session.execute(
+                select(ExpenseCategoryCount.category, ExpenseCategoryCount.count).where(
+                    ExpenseCategoryCount.wallet_id == wallet_id, ExpenseCategoryCount.count > 0
+                )
+            )
+            counts = dict(rows.all())
+            self._counts[wallet_id] = counts
+            while len(self._counts) > self.max_wallets:
+                self._counts.popitem(last=False)
+        self._counts.move_to_end(wallet_id)
+        return counts
+
+    async def top(self, session: AsyncSession, wallet_id: int, limit: int = TOP_CATEGORIES) -> tuple[str, ...]:
+        """Самые частые категории; из вариантов написания остаётся самый частый."""
+        counts = await self._wallet_counts(session, wallet_id)
+        top, seen = [], set()
+        for category in sorted(counts, key=lambda c: (-counts[c], c)):
+            key = category_key(category)
+            if key not in seen:
+                seen.add(key)
+                top.append(category)
+            if len(top) == limit:
+                break
+        return tuple(top)
+
+    async def normalise(self, session: AsyncSession, wallet_id: int, category: str) -> str:
+        """Приводит ввод к уже используемой в счёте категории, если она совпадает или очень похожа."""
+        category = " ".join(category.split())
+        counts = await self._wallet_counts(session, wallet_id)
+        by_key: dict[str, str] = {}
+        for existing in sorted(counts, key=lambda c: -counts[c]):
+            by_key.setdefault(category_key(existing), existing)
+
+        key = category_key(category)
+        if key in by_key:
+            return by_key[key]
+        close = difflib.get_close_matches(key, by_key, n=1, cutoff=CATEGORY_MATCH_CUTOFF)
+        return by_key[close[0]] if close else category
+
+    async def record(self, session: AsyncSession, wallet_id: int, category: str, sign: int = 1):
+        """Учитывает добавление (sign=1) или удаление (sign=-1) траты с категорией."""
+        await self.record_counts(session, wallet_id, {category: sign})
+
+    async def record_counts(self, session: AsyncSession, wallet_id: int, deltas: dict[str, int]):
+        """Изменяет частоты нескольких категорий одним запросом."""
+        await self.record_counts_many(session, {(wallet_id, category): delta for category, delta in deltas.items()})
+
+    async def record_counts_many(self, session: AsyncSession, deltas: dict[tuple[int, str], int]):
+        """То же для нескольких счетов сразу: ключи (счёт, категория)."""
+        stmt = insert(ExpenseCategoryCount).values([
+            {"wallet_id": wallet_id, "category": category, "count": delta}
+            for (wallet_id, category), delta in deltas.items()
+        ])
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[ExpenseCategoryCount.wallet_id, ExpenseCategoryCount.category],
+            set_={"count": ExpenseCategoryCount.count + stmt.excluded.count}
+        )
+        await session.execute(stmt)
+        after_commit(session, lambda: self._apply(deltas))
+
+    def _apply(self, deltas: dict[tuple[int, str], int]):
+        for (wallet_id, category), delta in deltas.items():
+            counts = self._counts.get(wallet_id)
+            if counts is not None:
+                counts[category] = counts.get(category, 0) + delta
+                if counts[category] <= 0:
+                    del counts[category]
+
+category_index = CategoryIndex()
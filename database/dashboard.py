@@ -0,0 +1,148 @@
+import time
+from collections import OrderedDict, defaultdict
+from dataclasses import dataclass
+from decimal import Decimal
+
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from utils.debts import member_balance, shared_share
+
+NET_POSITION_CACHE_USERS = 4096
+# Страховка на случай записи в журнал мимо invalidate_wallet (например, из другого процесса).
+NET_POSITION_CACHE_TTL = 300
+
+# Позиция пользователя во всех его счетах одним запросом: снимок журнала плюс строки после
+# него, как в database.ledger.load_positions, но сразу для всех счетов и только для одного
+# участника (общие траты нужны по счёту целиком).
+NET_POSITIONS_QUERY = text("""
+    WITH my_wallets AS (
+        SELECT w.id, w.name
+        FROM wallets w
+        JOIN wallet_members m ON m.wallet_id = w.id
+        WHERE m.user_id = :user_id AND w.deleted_at IS NULL
+    ),
+    member_counts AS (
+        SELECT wallet_id, COUNT(*) AS members
+        FROM wallet_members
+        WHERE wallet_id IN (SELECT id FROM my_wallets)
+        GROUP BY wallet_id
+    ),
+    checkpoints AS (
+        SELECT c.wallet_id, c.last_income_id, c.last_expense_id, c.shared_total, p.paid, p.personal_spent
+        FROM ledger_checkpoints c
+        LEFT JOIN ledger_checkpoint_positions p ON p.wallet_id = c.wallet_id AND p.user_id = :user_id
+        WHERE c.wallet_id IN (SELECT id FROM my_wallets)
+    ),
+    income_tail AS (
+        SELECT i.wallet_id, SUM(i.amount) AS paid
+        FROM incomes i
+        LEFT JOIN checkpoints c ON c.wallet_id = i.wallet_id
+        WHERE i.wallet_id IN (SELECT id FROM my_wallets) AND i.user_id = :user_id
+          AND i.id > COALESCE(c.last_income_id, 0)
+        GROUP BY i.wallet_id
+    ),
+    expense_tail AS (
+        SELECT e.wallet_id,
+               SUM(e.amount) FILTER (WHERE e.is_shared) AS shared_total,
+               SUM(e.amount) FILTER (WHERE NOT e.is_shared AND e.user_id = :user_id) AS personal_spent
+        FROM expenses e
+        LEFT JOIN checkpoints c ON c.wallet_id = e.wallet_id
+        WHERE e.wallet_id IN (SELECT id FROM my_wallets) AND e.id > COALESCE(c.last_expense_id, 0)
+        GROUP BY e.wallet_id
+    )
+    SELECT w.id, w.name, mc.members,
+           COALESCE(c.paid, 0) + COALESCE(it.paid, 0) AS paid,
+           COALESCE(c.personal_spent, 0) + COALESCE(et.personal_spent, 0) AS personal_spent,
+           COALESCE(c.shared_total, 0) + COALESCE(et.shared_total, 0) AS shared_total
+    FROM my_wallets w
+    JOIN member_counts mc ON mc.wallet_id = w.id
+    LEFT JOIN checkpoints c ON c.wallet_id = w.id
+    LEFT JOIN income_tail it ON it.wallet_id = w.id
+    LEFT JOIN expense_tail et ON et.wallet_id = w.id
+    ORDER BY w.id
+""")
+
+
+@dataclass(frozen=True)
+class WalletPosition:
+    wallet_id: int
+    name: str
+    paid: Decimal
+    personal_spent: Decimal
+    shared_share: float
+    balance: float
+
+
+async def load_net_positions(session: AsyncSession, user_id: int) -> list[WalletPosition]:
+    rows = await session.execute(NET_POSITIONS_QUERY, {"user_id": user_id})
+    return [
+        WalletPosition(
+            wallet_id=wallet_id,
+            name=name,
+            paid=paid,
+            personal_spent=personal_spent,
+            shared_share=shared_share(shared_total, members),
+            balance=member_balance(paid, personal_spent, shared_total, members)
+        )
+        for wallet_id, name, members, paid, personal_spent, shared_total in rows
+    ]
+
+
+class NetPositionCache:
+    """
+    Итог пользователя по всем счетам, закэшированный до следующей записи в журнал.
+
+    Запись в счёт меняет итог всех его участников (через долю общих трат), поэтому кэш
+    помнит, какие пользователи видели каждый счёт, и invalidate_wallet() сбрасывает их всех.
+    Сбрасывать нужно после фиксации транзакции: иначе другой участник может успеть
+    перечитать итог до фиксации, и старые суммы закэшируются на весь TTL.
+    """
+
+    def __init__(self, max_users: int = NET_POSITION_CACHE_USERS, ttl: float = NET_POSITION_CACHE_TTL):
+        self.max_users = max_users
+        self.ttl = ttl
+        self._positions: OrderedDict[int, tuple[list[WalletPosition], float]] = OrderedDict()
+        self._viewers: dict[int, set[int]] = defaultdict(set)
+
+    async def get(self, session: AsyncSession, user_id: int) -> list[WalletPosition]:
+        cached = self._positions.get(user_id)
+        if cached is not None and time.monotonic() - cached[1] < self.ttl:
+            self._positions.move_to_end(user_id)
+            return cached[0]
+
+        positions = await load_net_positions(session, user_id)
+        self._forget(user_id)
+        self._positions[user_id] = (positions, time.monotonic())
+        for position in positions:
+            self._viewers[position.wallet_id].add(user_id)
+        while len(self._positions) > self.max_users:
+            self._forget(next(iter(self._positions)))
+        return positions
+
+    async def wallet(self, session: AsyncSession, user_id: int, wallet_id: int) -> WalletPosition | None:
+        """Позиция пользователя в одном счёте; None, если он не участник или счёт удалён."""
+        return next((p for p in await self.get(session, user_id) if p.wallet_id == wallet_id), None)
+
+    def _forget(self, user_id: int):
+        """Убирает итог пользователя вместе с его отметками в _viewers, иначе они копятся без предела."""
+        cached = self._positions.pop(user_id, None)
+        if cached is None:
+            return
+        for position in cached[0]:
+            viewers = self._viewers.get(position.wallet_id)
+            if viewers is not None:
+                viewers.discard(user_id)
+                if not viewers:
+                    del self._viewers[position.wallet_id]
+
+    def invalidate_user(self, user_id: int):
+        self._forget(user_id)
+
+    def invalidate_wallet(self, wallet_id: int):
+        for user_id in list(self._viewers.get(wallet_id, ())):
+            self._forget(user_id)
+        self._viewers.pop(wallet_id, None)
+
+
+net_positions = NetPositionCache()
@@ -1,15 +1,53 @@
-from typing import AsyncGenerator
+import itertools
+import logging
+import time
+from typing import AsyncGenerator, Awaitable, Callable, TypeVar
 
-from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker, AsyncSession
+from sqlalchemy import text
+from sqlalchemy.exc import InterfaceError, OperationalError
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker, AsyncSession, AsyncEngine
 from database.models import Base
+from database.migrations import run_migrations, schema_is_current
+from database.partitions import ensure_partitions
+from database.rollups import backfill_rollups
 from config import settings
 
-engine = create_async_engine(
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+# Ошибки, после которых отчёт повторяется на основной БД: реплика упала, не отвечает
+# или оборвала соединение между проверками отставания.
+REPLICA_ERRORS = (OperationalError, InterfaceError, OSError, TimeoutError)
+
+REPLICA_LAG_QUERY = text(
+    "SELECT CASE WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0 "
+    "ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0) END"
+)
+
+
+def make_engine(url: str, pool_size: int, max_overflow: int, statement_cache_size: int,
+                connect_timeout: float | None = None, command_timeout: float | None = None) -> AsyncEngine:
+    connect_args = {"prepared_statement_cache_size": statement_cache_size}
+    if connect_timeout is not None:
+        connect_args["timeout"] = connect_timeout
+    if command_timeout is not None:
+        connect_args["command_timeout"] = command_timeout
+    return create_async_engine(
+        url,
+        echo=False,
+        pool_pre_ping=True,
+        pool_size=pool_size,
+        max_overflow=max_overflow,
+        connect_args=connect_args
+    )
+
+
+engine = make_engine(
     settings.database_url,
-    echo=False,
-    pool_pre_ping=True,
-    pool_size=10,
-    max_overflow=20
+    pool_size=settings.db_pool_size,
+    max_overflow=settings.db_max_overflow,
+    statement_cache_size=settings.db_statement_cache_size
 )
 
 async_session_maker = async_sessionmaker(
@@ -19,11 +57,104 @@ async_session_maker = async_sessionmaker(
 )
 
 
+class ReplicaRouter:
+    """
+    Выбор сессии для read-only запросов отчётов.
+
+    Реплики опрашиваются по кругу. Отставание каждой проверяется не чаще, чем раз в
+    `check_interval` секунд; реплика с отставанием больше `max_lag` секунд или
+    недоступная пропускается. Если подходящей реплики нет, используется основная БД.
+    Реплика может упасть и между проверками, поэтому отчёты читаются через read_query():
+    при ошибке реплика помечается недоступной, а запрос повторяется на основной БД.
+    Таймауты соединения и запроса у реплик короткие, чтобы мёртвый хост не держал отчёт.
+    """
+
+    def __init__(self, urls: list[str], max_lag: float, check_interval: float):
+        self.max_lag = max_lag
+        self.check_interval = check_interval
+        self.engines = [
+            make_engine(
+                url,
+                pool_size=settings.db_replica_pool_size,
+                max_overflow=settings.db_replica_max_overflow,
+                statement_cache_size=settings.db_replica_statement_cache_size,
+                connect_timeout=settings.db_replica_connect_timeout,
+                command_timeout=settings.db_replica_command_timeout
+            )
+            for url in urls
+        ]
+        self.session_makers = [
+            async_sessionmaker(e, class_=AsyncSession, expire_on_commit=False) for e in self.engines
+        ]
+        self._healthy: dict[int, tuple[bool, float]] = {}
+        self._order = itertools.cycle(range(len(self.engines)))
+
+    async def _is_fresh(self, index: int) -> bool:
+        now = time.monotonic()
+        cached = self._healthy.get(index)
+        if cached is not None and now - cached[1] < self.check_interval:
+            return cached[0]
+
+        try:
+            async with self.engines[index].connect() as conn:
+                lag = float((await conn.execute(REPLICA_LAG_QUERY)).scalar_one())
+            healthy = lag <= self.max_lag
+            if not healthy:
+                logger.warning("Реплика #%s отстаёт на %.1f с, чтение идёт с основной БД", index, lag)
+        except Exception as e:
+            logger.warning("Реплика #%s недоступна: %r", index, e)
+            healthy = False
+
+        self._healthy[index] = (healthy, now)
+        return healthy
+
+    def mark_unhealthy(self, index: int):
+        """Исключает реплику до следующей проверки через `check_interval` секунд."""
+        self._healthy[index] = (False, time.monotonic())
+
+    async def pick(self) -> int | None:
+        """Номер свежей реплики или None, если читать нужно с основной БД."""
+        for _ in range(len(self.engines)):
+            index = next(self._order)
+            if await self._is_fresh(index):
+                return index
+        return None
+
+
+replica_router = ReplicaRouter(
+    settings.replica_database_urls,
+    max_lag=settings.db_replica_max_lag,
+    check_interval=settings.db_replica_check_interval
+)
+
+
 async def init_db():
     async with engine.begin() as conn:
-        await conn.run_sync(Base.metadata.create_all)
+        if not await schema_is_current(conn):
+            await conn.run_sync(Base.metadata.create_all)
+            await backfill_rollups(conn)
+            await run_migrations(conn)
+        await ensure_partitions(conn, settings.db_partition_months_ahead)
 
 
 async def get_session() -> AsyncGenerator[AsyncSession]:
     async with async_session_maker() as session:
         yield session
+
+
+async def read_query(query: Callable[[AsyncSession], Awaitable[T]]) -> T:
+    """
+    Выполняет чтение для тяжёлого отчёта: на реплике, если она достаточно свежая, иначе на
+    основной БД. Если реплика отказала посреди запроса, `query` повторяется на основной БД,
+    поэтому она должна только читать и возвращать результат, а не отвечать пользователю.
+    """
+    index = await replica_router.pick()
+    if index is not None:
+        try:
+            async with replica_router.session_makers[index]() as session:
+                return await query(session)
+        except REPLICA_ERRORS as e:
+            logger.warning("Реплика #%s отказала, отчёт читается с основной БД: %r", index, e)
+            replica_router.mark_unhealthy(index)
+    async with async_session_maker() as session:
+        return await query(session)
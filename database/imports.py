@@ -0,0 +1,83 @@
+from collections import Counter, defaultdict
+from datetime import date, datetime
+from decimal import Decimal
+
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from config import settings
+from database.categories import category_index
+from database.db import engine
+from database.models import Wallet
+from database.partitions import add_months, ensure_months, month_start
+from database.rollups import apply_expense_totals, apply_income_totals
+from utils.csv_import import EXPENSE_COLUMNS, INCOME_COLUMNS, ParsedImport
+from utils.dates import to_moscow
+
+EXPENSE_AMOUNT = EXPENSE_COLUMNS.index("amount")
+EXPENSE_CATEGORY = EXPENSE_COLUMNS.index("category")
+EXPENSE_CREATED_AT = EXPENSE_COLUMNS.index("created_at")
+INCOME_AMOUNT = INCOME_COLUMNS.index("amount")
+INCOME_CREATED_AT = INCOME_COLUMNS.index("created_at")
+
+
+def archive_cutoff() -> datetime | None:
+    """Операции раньше этой даты попали бы в архивные (отсоединённые) секции."""
+    if settings.db_archive_after_months <= 0:
+        return None
+    return datetime.combine(add_months(month_start(date.today()), -settings.db_archive_after_months), datetime.min.time())
+
+
+async def ensure_import_partitions(parsed: ParsedImport):
+    """
+    Создаёт недостающие секции за месяцы файла в отдельной короткой транзакции.
+
+    CREATE TABLE ... PARTITION OF берёт ACCESS EXCLUSIVE на родительскую таблицу: в
+    транзакции импорта блокировка держалась бы до фиксации, на всё время COPY, и журнал
+    всех счетов стоял бы. Вызывается до import_ledger.
+    """
+    async with engine.begin() as conn:
+        await ensure_months(conn, "expenses", {month_start(row[EXPENSE_CREATED_AT].date()) for row in parsed.expenses})
+        await ensure_months(conn, "incomes", {month_start(row[INCOME_CREATED_AT].date()) for row in parsed.incomes})
+
+
+async def import_ledger(session: AsyncSession, wallet: Wallet, parsed: ParsedImport) -> Decimal:
+    """
+    Загружает разобранные строки в журнал через COPY в транзакции сессии. Секции за
+    месяцы файла должны уже существовать (ensure_import_partitions).
+
+    Баланс счёта, дневные агрегаты и частоты категорий меняются один раз на весь файл,
+    а не на каждую строку. Возвращает изменение баланса.
+    """
+    # Строка счёта блокируется до COPY: write_checkpoint берёт ту же блокировку и не сдвинет
+    # снимок за ID ещё не зафиксированных строк файла (их created_at бывает в прошлом). Запрос
+    # заодно открывает транзакцию сессии: COPY через драйвер её сам не начинает.
+    await session.execute(select(Wallet.id).where(Wallet.id == wallet.id).with_for_update())
+    conn = await session.connection()
+    driver = (await conn.get_raw_connection()).driver_connection
+    if parsed.expenses:
+        await driver.copy_records_to_table("expenses", records=parsed.expenses, columns=EXPENSE_COLUMNS)
+    if parsed.incomes:
+        await driver.copy_records_to_table("incomes", records=parsed.incomes, columns=INCOME_COLUMNS)
+
+    expense_totals = defaultdict(lambda: (Decimal(0), 0))
+    for row in parsed.expenses:
+        key = (to_moscow(row[EXPENSE_CREATED_AT]).date(), row[EXPENSE_CATEGORY])
+        amount, count = expense_totals[key]
+        expense_totals[key] = (amount + row[EXPENSE_AMOUNT], count + 1)
+    income_totals = defaultdict(lambda: (Decimal(0), 0))
+    for row in parsed.incomes:
+        day = to_moscow(row[INCOME_CREATED_AT]).date()
+        amount, count = income_totals[day]
+        income_totals[day] = (amount + row[INCOME_AMOUNT], count + 1)
+
+    if expense_totals:
+        await apply_expense_totals(session, wallet.id, expense_totals)
+        await category_index.record_counts(session, wallet.id, Counter(row[EXPENSE_CATEGORY] for row in parsed.expenses))
+    if income_totals:
+        await apply_income_totals(session, wallet.id, income_totals)
+
+    delta = sum((amount for amount, _ in income_totals.values()), Decimal(0)) - sum(
+        (amount for amount, _ in expense_totals.values()), Decimal(0))
+    wallet.balance += delta
+    return delta
@@ -0,0 +1,226 @@
+import asyncio
+import logging
+from collections import defaultdict
+from datetime import datetime, timedelta
+from decimal import Decimal
+from typing import Callable
+
+from sqlalchemy import select, func, text
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker
+
+from database.models import Wallet, Income, Expense, LedgerCheckpoint, LedgerCheckpointPosition
+
+logger = logging.getLogger(__name__)
+
+CHECKPOINT_INTERVAL = 60
+CHECKPOINT_IDLE_SECONDS = 30
+CHECKPOINT_MIN_ROWS = 200
+CHECKPOINT_BATCH = 20
+# Строки моложе этого возраста в снимок не попадают: транзакция, получившая меньший ID,
+# может зафиксироваться позже транзакции с большим.
+CHECKPOINT_SAFETY = timedelta(minutes=5)
+
+# Хвост каждого счёта считается по индексу (wallet_id, id) (миграция 6) и не дальше
+# min_rows строк: длинная история счетов не читается целиком на каждом тике.
+WALLETS_NEEDING_CHECKPOINT = text("""
+    SELECT w.id
+    FROM wallets w
+    LEFT JOIN ledger_checkpoints c ON c.wallet_id = w.id
+    WHERE w.deleted_at IS NULL AND (
+        (SELECT COUNT(*) FROM (
+            SELECT 1 FROM incomes i
+            WHERE i.wallet_id = w.id AND i.id > COALESCE(c.last_income_id, 0)
+            LIMIT :min_rows
+        ) tail) >= :min_rows
+        OR (SELECT COUNT(*) FROM (
+            SELECT 1 FROM expenses e
+            WHERE e.wallet_id = w.id AND e.id > COALESCE(c.last_expense_id, 0)
+            LIMIT :min_rows
+        ) tail) >= :min_rows
+    )
+    ORDER BY w.id
+    LIMIT :limit
+""")
+
+
+class LedgerPositions:
+    """Агрегаты журнала счёта: внесено и потрачено лично по участникам, сумма общих трат."""
+
+    def __init__(self):
+        self.paid: dict[int, Decimal] = defaultdict(Decimal)
+        self.personal_spent: dict[int, Decimal] = defaultdict(Decimal)
+        self.shared_total = Decimal(0)
+
+    async def fold(self, session: AsyncSession, wallet_id: int,
+                   after_income_id: int, after_expense_id: int,
+                   upto_income_id: int | None = None, upto_expense_id: int | None = None):
+        """Добавляет строки журнала с ID в полуинтервале (after, upto]."""
+        income_filter = [Income.wallet_id == wallet_id, Income.id > after_income_id]
+        if upto_income_id is not None:
+            income_filter.append(Income.id <= upto_income_id)
+        incomes = await session.execute(
+            select(Income.user_id, func.sum(Income.amount)).where(*income_filter).group_by(Income.user_id)
+        )
+        for user_id, amount in incomes:
+            self.paid[user_id] += amount
+
+        expense_filter = [Expense.wallet_id == wallet_id, Expense.id > after_expense_id]
+        if upto_expense_id is not None:
+            expense_filter.append(Expense.id <= upto_expense_id)
+        expenses = await session.execute(
+            select(Expense.user_id, Expense.is_shared, func.sum(Expense.amount))
+            .where(*expense_filter).group_by(Expense.user_id, Expense.is_shared)
+        )
+        for user_id, is_shared, amount in expenses:
+            if is_shared:
+                self.shared_total += amount
+            else:
+                self.personal_spent[user_id] += amount
+
+    @classmethod
+    def from_checkpoint(cls, checkpoint: LedgerCheckpoint | None, positions) -> "LedgerPositions":
+        result = cls()
+        if checkpoint is not None:
+            result.shared_total = checkpoint.shared_total
+            for pos in positions:
+                result.paid[pos.user_id] = pos.paid
+                result.personal_spent[pos.user_id] = pos.personal_spent
+        return result
+
+
+async def _load_checkpoint(session: AsyncSession, wallet_id: int, for_update: bool = False):
+    checkpoint = await session.get(LedgerCheckpoint, wallet_id, with_for_update=for_update)
+    positions = []
+    if checkpoint is not None:
+        positions = (await session.execute(
+            select(LedgerCheckpointPosition).where(LedgerCheckpointPosition.wallet_id == wallet_id)
+        )).scalars().all()
+    return checkpoint, positions
+
+
+async def load_positions(session: AsyncSession, wallet_id: int) -> LedgerPositions:
+    """Последний снимок счёта плюс строки журнала после него."""
+    checkpoint, positions = await _load_checkpoint(session, wallet_id)
+    result = LedgerPositions.from_checkpoint(checkpoint, positions)
+    await result.fold(
+        session, wallet_id,
+        after_income_id=checkpoint.last_income_id if checkpoint else 0,
+        after_expense_id=checkpoint.last_expense_id if checkpoint else 0
+    )
+    return result
+
+
+async def retract_from_checkpoint(session: AsyncSession, row: Income | Expense):
+    """
+    Вычитает удаляемую строку журнала из снимка, если она уже в него вошла.
+
+    Снимок не сбрасывается целиком: строки из архивных секций в журнале уже не видны,
+    и пересчитать их заново было бы нельзя.
+    """
+    checkpoint = await session.get(LedgerCheckpoint, row.wallet_id, with_for_update=True)
+    if checkpoint is None:
+        return
+    last_id = checkpoint.last_income_id if isinstance(row, Income) else checkpoint.last_expense_id
+    if row.id > last_id:
+        return
+
+    if isinstance(row, Expense) and row.is_shared:
+        checkpoint.shared_total -= row.amount
+        return
+    position = await session.get(LedgerCheckpointPosition, (row.wallet_id, row.user_id), with_for_update=True)
+    if position is None:
+        return
+    if isinstance(row, Income):
+        position.paid -= row.amount
+    else:
+        position.personal_spent -= row.amount
+
+
+async def write_checkpoint(session: AsyncSession, wallet_id: int) -> bool:
+    """Сдвигает снимок счёта к строкам старше CHECKPOINT_SAFETY. Возвращает True, если снимок обновлён."""
+    # Блокировка строки счёта упорядочивает запись снимка с хендлерами, которые меняют баланс
+    # и при удалении старых строк сбрасывают снимок в той же транзакции.
+    wallet = await session.get(Wallet, wallet_id, with_for_update=True)
+    if wallet is None:
+        return False
+
+    cutoff = datetime.now() - CHECKPOINT_SAFETY
+    upto_income_id = (await session.execute(
+        select(func.coalesce(func.max(Income.id), 0)).where(Income.wallet_id == wallet_id, Income.created_at < cutoff)
+    )).scalar_one()
+    upto_expense_id = (await session.execute(
+        select(func.coalesce(func.max(Expense.id), 0)).where(Expense.wallet_id == wallet_id, Expense.created_at < cutoff)
+    )).scalar_one()
+
+    checkpoint, positions = await _load_checkpoint(session, wallet_id, for_update=True)
+    after_income_id = checkpoint.last_income_id if checkpoint else 0
+    after_expense_id = checkpoint.last_expense_id if checkpoint else 0
+    if upto_income_id <= after_income_id and upto_expense_id <= after_expense_id:
+        return False
+
+    result = LedgerPositions.from_checkpoint(checkpoint, positions)
+    await result.fold(
+        session, wallet_id,
+        after_income_id=after_income_id, after_expense_id=after_expense_id,
+        upto_income_id=max(upto_income_id, after_income_id), upto_expense_id=max(upto_expense_id, after_expense_id)
+    )
+
+    if checkpoint is None:
+        checkpoint = LedgerCheckpoint(wallet_id=wallet_id)
+        session.add(checkpoint)
+    checkpoint.last_income_id = max(upto_income_id, after_income_id)
+    checkpoint.last_expense_id = max(upto_expense_id, after_expense_id)
+    checkpoint.shared_total = result.shared_total
+    checkpoint.created_at = datetime.now()
+
+    existing = {pos.user_id: pos for pos in positions}
+    for user_id in set(result.paid) | set(result.personal_spent):
+        position = existing.get(user_id)
+        if position is None:
+            position = LedgerCheckpointPosition(wallet_id=wallet_id, user_id=user_id)
+            session.add(position)
+        position.paid = result.paid.get(user_id, Decimal(0))
+        position.personal_spent = result.personal_spent.get(user_id, Decimal(0))
+    return True
+
+
+async def wallets_needing_checkpoint(session: AsyncSession, min_rows: int, limit: int) -> list[int]:
+    """Счета, у которых после снимка накопилось не меньше min_rows строк журнала."""
+    rows = await session.execute(WALLETS_NEEDING_CHECKPOINT, {"min_rows": min_rows, "limit": limit})
+    return list(rows.scalars().all())
+
+
+class CheckpointWriter:
+    """Фоновая задача: пока бот простаивает, сдвигает снимки счетов с длинным хвостом журнала."""
+
+    def __init__(self, session_maker: async_sessionmaker, idle_for: Callable[[], float],
+                 interval: float = CHECKPOINT_INTERVAL, idle_seconds: float = CHECKPOINT_IDLE_SECONDS):
+        self.session_maker = session_maker
+        self.idle_for = idle_for
+        self.interval = interval
+        self.idle_seconds = idle_seconds
+
+    async def run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            if self.idle_for() < self.idle_seconds:
+                continue
+            try:
+                await self.tick()
+            except Exception as e:
+                logger.exception("Ошибка при записи снимков журнала: %s", e)
+
+    async def tick(self) -> int:
+        async with self.session_maker() as session:
+            wallet_ids = await wallets_needing_checkpoint(session, CHECKPOINT_MIN_ROWS, CHECKPOINT_BATCH)
+
+        written = 0
+        for wallet_id in wallet_ids:
+            if self.idle_for() < self.idle_seconds:
+                break
+            async with self.session_maker() as session:
+                async with session.begin():
+                    written += await write_checkpoint(session, wallet_id)
+        if written:
+            logger.info("Обновлено снимков журнала: %s", written)
+        return written
@@ -0,0 +1,126 @@
+import logging
+from datetime import date
+from typing import Awaitable, Callable
+
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncConnection
+
+from database.categories import backfill_category_counts
+from database.models import RecurringExpense
+from database.partitions import PARTITIONED_TABLES, create_partition, month_start, add_months
+from database.search import SEARCH_DOCUMENT_SQL
+from config import settings
+
+logger = logging.getLogger(__name__)
+
+CREATE_MIGRATIONS_TABLE = text("""
+    CREATE TABLE IF NOT EXISTS schema_migrations (
+        version INTEGER PRIMARY KEY,
+        name VARCHAR(255) NOT NULL,
+        applied_at TIMESTAMP NOT NULL DEFAULT now()
+    )
+""")
+
+
+async def partition_ledger_tables(conn: AsyncConnection):
+    """Переводит incomes и expenses на помесячное секционирование по created_at."""
+    for table in PARTITIONED_TABLES:
+        old = f"{table}_unpartitioned"
+        await conn.execute(text(f"UPDATE {table} SET created_at = now() WHERE created_at IS NULL"))
+        await conn.execute(text(f"ALTER TABLE {table} RENAME TO {old}"))
+        await conn.execute(text(f"ALTER TABLE {old} RENAME CONSTRAINT {table}_pkey TO {old}_pkey"))
+        await conn.execute(text(
+            f"CREATE TABLE {table} (LIKE {old} INCLUDING DEFAULTS) PARTITION BY RANGE (created_at)"
+        ))
+        await conn.execute(text(f"ALTER TABLE {table} ALTER COLUMN created_at SET NOT NULL"))
+        await conn.execute(text(f"ALTER TABLE {table} ADD PRIMARY KEY (id, created_at)"))
+        await conn.execute(text(f"ALTER TABLE {table} ADD FOREIGN KEY (wallet_id) REFERENCES wallets (id)"))
+        await conn.execute(text(f"ALTER TABLE {table} ADD FOREIGN KEY (user_id) REFERENCES users (id)"))
+        await conn.execute(text(f"CREATE INDEX ix_{table}_wallet_created ON {table} (wallet_id, created_at)"))
+        await conn.execute(text(
+            f"CREATE INDEX ix_{table}_wallet_user_created ON {table} (wallet_id, user_id, created_at)"
+        ))
+
+        first = (await conn.execute(text(f"SELECT min(created_at) FROM {old}"))).scalar_one()
+        month = month_start(first.date() if first else date.today())
+        last = add_months(month_start(date.today()), settings.db_partition_months_ahead)
+        while month <= last:
+            await create_partition(conn, table, month)
+            month = add_months(month, 1)
+
+        await conn.execute(text(f"INSERT INTO {table} SELECT * FROM {old}"))
+        await conn.execute(text(f"ALTER SEQUENCE {table}_id_seq OWNED BY {table}.id"))
+        await conn.execute(text(f"DROP TABLE {old}"))
+
+
+WALLET_FOREIGN_KEYS = text("""
+    SELECT conname FROM pg_constraint
+    WHERE conrelid = CAST(:table AS regclass) AND confrelid = CAST('wallets' AS regclass) AND contype = 'f'
+""")
+
+
+async def soft_delete_wallets(conn: AsyncConnection):
+    """Добавляет wallets.deleted_at и переводит ссылки на счёт в журнале на ON DELETE CASCADE."""
+    await conn.execute(text("ALTER TABLE wallets ADD COLUMN IF NOT EXISTS deleted_at TIMESTAMP"))
+    await conn.execute(text(
+        "CREATE INDEX IF NOT EXISTS ix_wallets_deleted_at ON wallets (deleted_at) WHERE deleted_at IS NOT NULL"
+    ))
+    for table in ("wallet_members", *PARTITIONED_TABLES):
+        for constraint in (await conn.execute(WALLET_FOREIGN_KEYS, {"table": table})).scalars().all():
+            await conn.execute(text(f'ALTER TABLE {table} DROP CONSTRAINT "{constraint}"'))
+        await conn.execute(text(
+            f"ALTER TABLE {table} ADD FOREIGN KEY (wallet_id) REFERENCES wallets (id) ON DELETE CASCADE"
+        ))
+
+
+async def expense_search_index(conn: AsyncConnection):
+    """Триграммный GIN-индекс для поиска трат по подстроке (ILIKE)."""
+    await conn.execute(text("CREATE EXTENSION IF NOT EXISTS pg_trgm"))
+    await conn.execute(text(
+        f"CREATE INDEX IF NOT EXISTS ix_expenses_search_trgm ON expenses USING gin ({SEARCH_DOCUMENT_SQL} gin_trgm_ops)"
+    ))
+
+
+async def create_recurring_expenses(conn: AsyncConnection):
+    """Шаблоны регулярных трат с индексом по next_run_at для планировщика."""
+    await conn.run_sync(RecurringExpense.__table__.create, checkfirst=True)
+
+
+async def ledger_wallet_id_index(conn: AsyncConnection):
+    """Индексы (wallet_id, id) для поиска хвоста журнала после снимка."""
+    for table in PARTITIONED_TABLES:
+        await conn.execute(text(f"CREATE INDEX IF NOT EXISTS ix_{table}_wallet_id_id ON {table} (wallet_id, id)"))
+
+
+# Любое изменение схемы (включая новые таблицы) добавляется сюда новой версией: если все
+# версии уже применены, init_db пропускает create_all и не тратит время на проверку таблиц.
+MIGRATIONS: list[tuple[int, str, Callable[[AsyncConnection], Awaitable[None]]]] = [
+    (1, "partition_ledger_tables", partition_ledger_tables),
+    (2, "soft_delete_wallets", soft_delete_wallets),
+    (3, "expense_search_index", expense_search_index),
+    (4, "backfill_category_counts", backfill_category_counts),
+    (5, "create_recurring_expenses", create_recurring_expenses),
+    (6, "ledger_wallet_id_index", ledger_wallet_id_index),
+]
+
+
+async def schema_is_current(conn: AsyncConnection) -> bool:
+    if (await conn.execute(text("SELECT to_regclass('schema_migrations')"))).scalar_one() is None:
+        return False
+    latest = (await conn.execute(text("SELECT max(version) FROM schema_migrations"))).scalar_one()
+    return latest == MIGRATIONS[-1][0]
+
+
+async def run_migrations(conn: AsyncConnection):
+    """Применяет ещё не применённые миграции по порядку в транзакции init_db."""
+    await conn.execute(CREATE_MIGRATIONS_TABLE)
+    applied = set((await conn.execute(text("SELECT version FROM schema_migrations"))).scalars().all())
+    for version, name, migration in MIGRATIONS:
+        if version in applied:
+            continue
+        logger.info("Применяется миграция %s: %s", version, name)
+        await migration(conn)
+        await conn.execute(
+            text("INSERT INTO schema_migrations (version, name) VALUES (:version, :name)"),
+            {"version": version, "name": name}
+        )
@@ -1,7 +1,7 @@
-from datetime import datetime
+from datetime import datetime, date
 from decimal import Decimal
 
-from sqlalchemy import BigInteger, String, Numeric, DateTime, Boolean, ForeignKey, Text
+from sqlalchemy import BigInteger, String, Numeric, DateTime, Boolean, ForeignKey, Text, Date, Integer, Index
 from sqlalchemy.orm import DeclarativeBase, Mapped, mapped_column, relationship
 from typing import List
 
@@ -16,7 +16,7 @@ class User(Base):
     id: Mapped[int] = mapped_column(BigInteger, primary_key=True)
     username: Mapped[str] = mapped_column(String(255), nullable=True)
     first_name: Mapped[str] = mapped_column(String(255))
-    created_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.now())
+    created_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.now)
 
     owned_wallets: Mapped[List["Wallet"]] = relationship(back_populates="owner", cascade="all, delete-orphan")
     wallet_members: Mapped[List["WalletMember"]] = relationship(back_populates="user")
@@ -28,11 +28,11 @@ class Income(Base):
     __tablename__ = "incomes"
 
     id: Mapped[int] = mapped_column(primary_key=True, autoincrement=True)
-    wallet_id: Mapped[int] = mapped_column(ForeignKey("wallets.id"))
+    wallet_id: Mapped[int] = mapped_column(ForeignKey("wallets.id", ondelete="CASCADE"))
     user_id: Mapped[int] = mapped_column(BigInteger, ForeignKey("users.id"))
     amount: Mapped[Decimal] = mapped_column(Numeric(12, 2))
     description: Mapped[str] = mapped_column(String(255), nullable=True)
-    created_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.now())
+    created_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.now)
 
     wallet: Mapped["Wallet"] = relationship(back_populates="incomes")
     user: Mapped["User"] = relationship(back_populates="incomes")
@@ -40,26 +40,38 @@ class Income(Base):
 
 class Wallet(Base):
     __tablename__ = "wallets"
+    __table_args__ = (
+        Index("ix_wallets_deleted_at", "deleted_at", postgresql_where="deleted_at IS NOT NULL"),
+    )
 
     id: Mapped[int] = mapped_column(primary_key=True, autoincrement=True)
     name: Mapped[str] = mapped_column(String(255))
     owner_id: Mapped[int] = mapped_column(BigInteger, ForeignKey("users.id"))
     balance: Mapped[Decimal] = mapped_column(Numeric(12, 2), default=Decimal(0))
-    created_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.now())
+    created_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.now)
+    # Счёт удалён пользователем и ждёт фоновой очистки журнала (database.wallets.WalletPurger).
+    deleted_at: Mapped[datetime] = mapped_column(DateTime, nullable=True)
 
     owner: Mapped["User"] = relationship(back_populates="owned_wallets")
-    members: Mapped[List["WalletMember"]] = relationship(back_populates="wallet", cascade="all, delete-orphan")
-    expenses: Mapped[List["Expense"]] = relationship(back_populates="wallet", cascade="all, delete-orphan")
-    incomes: Mapped[List["Income"]] = relationship(back_populates="wallet", cascade="all, delete-orphan")
+    # Строки журнала удаляются на стороне БД (ON DELETE CASCADE), ORM их не загружает.
+    members: Mapped[List["WalletMember"]] = relationship(
+        back_populates="wallet", cascade="all, delete-orphan", passive_deletes=True
+    )
+    expenses: Mapped[List["Expense"]] = relationship(
+        back_populates="wallet", cascade="all, delete-orphan", passive_deletes=True
+    )
+    incomes: Mapped[List["Income"]] = relationship(
+        back_populates="wallet", cascade="all, delete-orphan", passive_deletes=True
+    )
 
 
 class WalletMember(Base):
     __tablename__ = "wallet_members"
 
     id: Mapped[int] = mapped_column(primary_key=True, autoincrement=True)
-    wallet_id: Mapped[int] = mapped_column(ForeignKey("wallets.id"))
+    wallet_id: Mapped[int] = mapped_column(ForeignKey("wallets.id", ondelete="CASCADE"))
     user_id: Mapped[int] = mapped_column(BigInteger, ForeignKey("users.id"))
-    joined_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.now())
+    joined_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.now)
 
     wallet: Mapped["Wallet"] = relationship(back_populates="members")
     user: Mapped["User"] = relationship(back_populates="wallet_members")
@@ -69,14 +81,94 @@ class Expense(Base):
     __tablename__ = "expenses"
 
     id: Mapped[int] = mapped_column(primary_key=True, autoincrement=True)
-    wallet_id: Mapped[int] = mapped_column(ForeignKey("wallets.id"))
+    wallet_id: Mapped[int] = mapped_column(ForeignKey("wallets.id", ondelete="CASCADE"))
     user_id: Mapped[int] = mapped_column(BigInteger, ForeignKey("users.id"))
     category: Mapped[str] = mapped_column(String(100))
     destination: Mapped[str] = mapped_column(String(255))
     amount: Mapped[Decimal] = mapped_column(Numeric(12, 2))
     is_shared: Mapped[bool] = mapped_column(Boolean, default=False)
     description: Mapped[str] = mapped_column(Text, nullable=True)
-    created_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.now())
+    created_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.now)
 
     wallet: Mapped["Wallet"] = relationship(back_populates="expenses")
     user: Mapped["User"] = relationship(back_populates="expenses")
+
+
+class RecurringExpense(Base):
+    """Шаблон регулярной траты: раз в месяц планировщик записывает по нему трату в журнал."""
+    __tablename__ = "recurring_expenses"
+    __table_args__ = (
+        Index("ix_recurring_expenses_next_run_at", "next_run_at"),
+    )
+
+    id: Mapped[int] = mapped_column(primary_key=True, autoincrement=True)
+    wallet_id: Mapped[int] = mapped_column(ForeignKey("wallets.id", ondelete="CASCADE"))
+    user_id: Mapped[int] = mapped_column(BigInteger, ForeignKey("users.id"))
+    category: Mapped[str] = mapped_column(String(100))
+    destination: Mapped[str] = mapped_column(String(255))
+    amount: Mapped[Decimal] = mapped_column(Numeric(12, 2))
+    is_shared: Mapped[bool] = mapped_column(Boolean, default=False)
+    # День месяца (1–31); в коротких месяцах трата записывается в последний день.
+    day_of_month: Mapped[int] = mapped_column(Integer)
+    # Когда записать следующую трату (UTC). Сдвигается в той же транзакции, что и запись траты.
+    next_run_at: Mapped[datetime] = mapped_column(DateTime)
+    created_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.now)
+
+
+class ExpenseDailyRollup(Base):
+    """Суммы трат счёта за день (по Москве) в разрезе категорий."""
+    __tablename__ = "expense_daily_rollups"
+
+    wallet_id: Mapped[int] = mapped_column(ForeignKey("wallets.id", ondelete="CASCADE"), primary_key=True)
+    day: Mapped[date] = mapped_column(Date, primary_key=True)
+    category: Mapped[str] = mapped_column(String(100), primary_key=True)
+    amount: Mapped[Decimal] = mapped_column(Numeric(14, 2), default=Decimal(0))
+    count: Mapped[int] = mapped_column(Integer, default=0)
+
+
+class IncomeDailyRollup(Base):
+    """Суммы пополнений счёта за день (по Москве)."""
+    __tablename__ = "income_daily_rollups"
+
+    wallet_id: Mapped[int] = mapped_column(ForeignKey("wallets.id", ondelete="CASCADE"), primary_key=True)
+    day: Mapped[date] = mapped_column(Date, primary_key=True)
+    amount: Mapped[Decimal] = mapped_column(Numeric(14, 2), default=Decimal(0))
+    count: Mapped[int] = mapped_column(Integer, default=0)
+
+
+class ExpenseCategoryCount(Base):
+    """Сколько трат счёта записано с категорией: подсказки и нормализация категорий."""
+    __tablename__ = "expense_category_counts"
+
+    wallet_id: Mapped[int] = mapped_column(ForeignKey("wallets.id", ondelete="CASCADE"), primary_key=True)
+    category: Mapped[str] = mapped_column(String(100), primary_key=True)
+    count: Mapped[int] = mapped_column(Integer, default=0)
+
+
+class LedgerCheckpoint(Base):
+    """Снимок журнала счёта до указанных ID пополнений и трат включительно."""
+    __tablename__ = "ledger_checkpoints"
+
+    wallet_id: Mapped[int] = mapped_column(ForeignKey("wallets.id", ondelete="CASCADE"), primary_key=True)
+    last_income_id: Mapped[int] = mapped_column(Integer, default=0)
+    last_expense_id: Mapped[int] = mapped_column(Integer, default=0)
+    shared_total: Mapped[Decimal] = mapped_column(Numeric(14, 2), default=Decimal(0))
+    created_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.now)
+
+    positions: Mapped[List["LedgerCheckpointPosition"]] = relationship(
+        back_populates="checkpoint", cascade="all, delete-orphan", passive_deletes=True
+    )
+
+
+class LedgerCheckpointPosition(Base):
+    """Позиция участника в снимке: сколько внёс и сколько потратил лично."""
+    __tablename__ = "ledger_checkpoint_positions"
+
+    wallet_id: Mapped[int] = mapped_column(
+        ForeignKey("ledger_checkpoints.wallet_id", ondelete="CASCADE"), primary_key=True
+    )
+    user_id: Mapped[int] = mapped_column(BigInteger, primary_key=True)
+    paid: Mapped[Decimal] = mapped_column(Numeric(14, 2), default=Decimal(0))
+    personal_spent: Mapped[Decimal] = mapped_column(Numeric(14, 2), default=Decimal(0))
+
+    checkpoint: Mapped["LedgerCheckpoint"] = relationship(back_populates="positions")
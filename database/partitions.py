@@ -0,0 +1,144 @@
+import asyncio
+import logging
+from datetime import date
+
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncConnection, async_sessionmaker
+
+from config import settings
+from database.ledger import write_checkpoint
+
+logger = logging.getLogger(__name__)
+
+PARTITIONED_TABLES = ("incomes", "expenses")
+CHECKPOINT_COLUMNS = {"incomes": "last_income_id", "expenses": "last_expense_id"}
+PARTITION_MAINTENANCE_INTERVAL = 24 * 60 * 60
+
+ATTACHED_PARTITIONS = text("""
+    SELECT child.relname
+    FROM pg_inherits
+    JOIN pg_class parent ON parent.oid = pg_inherits.inhparent
+    JOIN pg_class child ON child.oid = pg_inherits.inhrelid
+    WHERE parent.relname = :table
+    ORDER BY child.relname
+""")
+
+FOREIGN_KEYS = text("""
+    SELECT conname FROM pg_constraint WHERE conrelid = CAST(:table AS regclass) AND contype = 'f'
+""")
+
+
+def month_start(value: date) -> date:
+    return value.replace(day=1)
+
+
+def add_months(value: date, months: int) -> date:
+    month = value.month - 1 + months
+    return value.replace(year=value.year + month // 12, month=month % 12 + 1, day=1)
+
+
+def partition_name(table: str, month: date) -> str:
+    return f"{table}_y{month.year}m{month.month:02d}"
+
+
+def partition_month(name: str) -> date:
+    year, month = name.rsplit("_y", 1)[1].split("m")
+    return date(int(year), int(month), 1)
+
+
+async def create_partition(conn: AsyncConnection, table: str, month: date):
+    await conn.execute(text(
+        f"CREATE TABLE IF NOT EXISTS {partition_name(table, month)} PARTITION OF {table} "
+        f"FOR VALUES FROM ('{month.isoformat()}') TO ('{add_months(month, 1).isoformat()}')"
+    ))
+
+
+async def ensure_months(conn: AsyncConnection, table: str, months: set[date]):
+    """Создаёт недостающие секции за указанные месяцы (например, для импорта прошлых операций)."""
+    attached = set((await conn.execute(ATTACHED_PARTITIONS, {"table": table})).scalars().all())
+    for month in sorted(months):
+        if partition_name(table, month) not in attached:
+            await create_partition(conn, table, month)
+
+
+async def ensure_partitions(conn: AsyncConnection, months_ahead: int):
+    """Создаёт секции с текущего месяца на months_ahead месяцев вперёд."""
+    current = month_start(date.today())
+    for table in PARTITIONED_TABLES:
+        for offset in range(months_ahead + 1):
+            await create_partition(conn, table, add_months(current, offset))
+
+
+async def _uncovered_wallets(conn: AsyncConnection, table: str, partition: str) -> list[int]:
+    """Счета, строки которых в секции ещё не вошли в снимок журнала."""
+    column = CHECKPOINT_COLUMNS[table]
+    return list((await conn.execute(text(f"""
+        SELECT DISTINCT p.wallet_id FROM {partition} p
+        LEFT JOIN ledger_checkpoints c ON c.wallet_id = p.wallet_id
+        WHERE p.id > COALESCE(c.{column}, 0)
+    """))).scalars().all())
+
+
+async def archive_partitions(session_maker: async_sessionmaker, before: date) -> list[str]:
+    """
+    Отсоединяет секции за месяцы раньше `before`.
+
+    Дневные агрегаты (статистика) ведутся при каждой записи, а позиции участников сначала
+    переносятся в снимки журнала; секция отсоединяется, только если все её строки вошли в
+    снимки. Отсоединённая таблица остаётся в БД как архив, без внешних ключей, чтобы не
+    мешать удалению счетов.
+    """
+    archived = []
+    for table in PARTITIONED_TABLES:
+        async with session_maker() as session:
+            conn = await session.connection()
+            partitions = (await conn.execute(ATTACHED_PARTITIONS, {"table": table})).scalars().all()
+
+        for partition in partitions:
+            if partition_month(partition) >= before:
+                continue
+
+            async with session_maker() as session:
+                wallet_ids = await _uncovered_wallets(await session.connection(), table, partition)
+            for wallet_id in wallet_ids:
+                async with session_maker() as session:
+                    async with session.begin():
+                        await write_checkpoint(session, wallet_id)
+
+            async with session_maker() as session:
+                async with session.begin():
+                    conn = await session.connection()
+                    if await _uncovered_wallets(conn, table, partition):
+                        logger.warning("Секция %s не полностью покрыта снимками, архивация отложена", partition)
+                        continue
+                    await conn.execute(text(f"ALTER TABLE {table} DETACH PARTITION {partition}"))
+                    for constraint in (await conn.execute(FOREIGN_KEYS, {"table": partition})).scalars().all():
+                        await conn.execute(text(f'ALTER TABLE {partition} DROP CONSTRAINT "{constraint}"'))
+            logger.info("Секция %s отсоединена в архив", partition)
+            archived.append(partition)
+    return archived
+
+
+class PartitionMaintainer:
+    """Фоновая задача: раз в сутки создаёт будущие секции и, если включено, архивирует старые."""
+
+    def __init__(self, session_maker: async_sessionmaker, interval: float = PARTITION_MAINTENANCE_INTERVAL):
+        self.session_maker = session_maker
+        self.interval = interval
+
+    async def run(self):
+        while True:
+            try:
+                await self.tick()
+            except Exception as e:
+                logger.exception("Ошибка обслуживания секций: %s", e)
+            await asyncio.sleep(self.interval)
+
+    async def tick(self):
+        async with self.session_maker() as session:
+            async with session.begin():
+                await ensure_partitions(await session.connection(), settings.db_partition_months_ahead)
+
+        if settings.db_archive_after_months > 0:
+            before = add_months(month_start(date.today()), -settings.db_archive_after_months)
+            await archive_partitions(self.session_maker, before)
@@ -0,0 +1,191 @@
+import asyncio
+import calendar
+import logging
+from collections import defaultdict
+from datetime import date, datetime, time, timezone
+from decimal import Decimal
+
+from sqlalchemy import select, insert, update, bindparam, func
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker
+
+from database.categories import category_index
+from database.dashboard import net_positions
+from database.imports import archive_cutoff
+from database.models import Wallet, Expense, RecurringExpense
+from database.partitions import add_months, ensure_months, month_start
+from database.rollups import apply_expense_totals_many
+from utils.dates import moscow_tz, to_moscow
+from utils.notifications import WalletNotifier
+
+logger = logging.getLogger(__name__)
+
+RECURRING_INTERVAL = 60
+# Шаблонов за одну транзакцию; если их больше, следующая пачка берётся сразу.
+RECURRING_BATCH = 500
+# Сколько пропущенных месяцев одного шаблона записать за раз (бот мог долго не работать).
+RECURRING_MAX_CATCH_UP = 12
+# Во сколько по Москве записывается регулярная трата.
+RECURRING_HOUR = 9
+
+UPDATE_BALANCE = (
+    update(Wallet.__table__)
+    .where(Wallet.__table__.c.id == bindparam("wallet"))
+    .values(balance=Wallet.__table__.c.balance - bindparam("amount"))
+)
+
+
+def run_at(month: date, day_of_month: int) -> datetime:
+    """Время записи траты в указанном месяце: наивное время UTC, как в БД."""
+    day = min(day_of_month, calendar.monthrange(month.year, month.month)[1])
+    local = moscow_tz().localize(datetime.combine(month.replace(day=day), time(RECURRING_HOUR)))
+    return local.astimezone(timezone.utc).replace(tzinfo=None)
+
+
+def first_run_at(day_of_month: int, now: datetime) -> datetime:
+    """Ближайшая запись после `now` (UTC): в этом месяце, если день ещё не прошёл, иначе в следующем."""
+    month = month_start(to_moscow(now).date())
+    first = run_at(month, day_of_month)
+    return first if first > now else run_at(add_months(month, 1), day_of_month)
+
+
+def _next_run_at(template: RecurringExpense) -> datetime:
+    return run_at(add_months(month_start(to_moscow(template.next_run_at).date()), 1), template.day_of_month)
+
+
+class RecurringScheduler:
+    """
+    Фоновая задача: записывает регулярные траты, срок которых наступил.
+
+    За тик наступившие шаблоны выбираются одним запросом по индексу next_run_at
+    (FOR UPDATE SKIP LOCKED), траты вставляются пачкой, а баланс, дневные агрегаты и
+    частоты категорий меняются одним запросом на всю пачку. Сдвиг next_run_at идёт в той
+    же транзакции, что и вставка, поэтому перезапуск посреди тика не даёт дублей: либо
+    транзакция зафиксирована вместе со сдвигом, либо откатана целиком. Уведомления об
+    общих тратах уходят после фиксации через WalletNotifier. Недостающие секции журнала
+    создаются до этой транзакции, отдельной короткой (как ensure_import_partitions).
+    """
+
+    def __init__(self, session_maker: async_sessionmaker, notifier: WalletNotifier,
+                 batch_size: int = RECURRING_BATCH, interval: float = RECURRING_INTERVAL):
+        self.session_maker = session_maker
+        self.notifier = notifier
+        self.batch_size = batch_size
+        self.interval = interval
+
+    async def run(self):
+        while True:
+            try:
+                while await self.tick() == self.batch_size:
+                    await asyncio.sleep(0)
+            except Exception as e:
+                logger.exception("Ошибка записи регулярных трат: %s", e)
+            await asyncio.sleep(self.interval)
+
+    async def tick(self) -> int:
+        """Обрабатывает одну пачку наступивших шаблонов; возвращает их число."""
+        now = datetime.now(timezone.utc).replace(tzinfo=None)
+        await self._ensure_partitions(now)
+        async with self.session_maker() as session:
+            async with session.begin():
+                due = (await session.execute(
+                    select(RecurringExpense, Wallet.name)
+                    .join(Wallet, Wallet.id == RecurringExpense.wallet_id)
+                    .where(RecurringExpense.next_run_at <= now, Wallet.deleted_at.is_(None))
+                    .order_by(RecurringExpense.next_run_at)
+                    .limit(self.batch_size)
+                    .with_for_update(of=RecurringExpense, skip_locked=True)
+                )).all()
+                if not due:
+                    return 0
+                expenses = self._collect(due, now)
+                if expenses:
+                    await self._post(session, expenses)
+
+        wallet_names = {template.wallet_id: name for template, name in due}
+        for row in expenses:
+            net_positions.invalidate_wallet(row["wallet_id"])
+            if row["is_shared"]:
+                self.notifier.notify(
+                    row["wallet_id"], wallet_names[row["wallet_id"]], 0,
+                    f"🔁 {row['amount']} ₽ · {row['category']} — {row['destination']} (регулярная)"
+                )
+        logger.info("Записано регулярных трат: %s по %s шаблонам", len(expenses), len(due))
+        return len(due)
+
+    async def _ensure_partitions(self, now: datetime):
+        """
+        Секции за месяцы от самого старого наступившего шаблона до текущего.
+
+        CREATE TABLE ... PARTITION OF берёт ACCESS EXCLUSIVE на expenses: внутри транзакции
+        тика блокировка держалась бы до фиксации всей пачки.
+        """
+        async with self.session_maker() as session:
+            async with session.begin():
+                oldest = await session.scalar(
+                    select(func.min(RecurringExpense.next_run_at))
+                    .join(Wallet, Wallet.id == RecurringExpense.wallet_id)
+                    .where(RecurringExpense.next_run_at <= now, Wallet.deleted_at.is_(None))
+                )
+                if oldest is None:
+                    return
+                cutoff = archive_cutoff()
+                if cutoff is not None:
+                    oldest = max(oldest, cutoff)
+                months, month = set(), month_start(oldest.date())
+                while month <= now.date():
+                    months.add(month)
+                    month = add_months(month, 1)
+                await ensure_months(await session.connection(), "expenses", months)
+
+    @staticmethod
+    def _collect(due, now: datetime) -> list[dict]:
+        """Строки трат по наступившим шаблонам; next_run_at шаблонов сдвигается на следующий месяц."""
+        cutoff = archive_cutoff()
+        expenses = []
+        for template, _ in due:
+            for _ in range(RECURRING_MAX_CATCH_UP):
+                if template.next_run_at > now:
+                    break
+                # Месяцы, ушедшие в архивные секции, пропускаются: в журнал они уже не попадут.
+                if cutoff is None or template.next_run_at >= cutoff:
+                    expenses.append({
+                        "wallet_id": template.wallet_id,
+                        "user_id": template.user_id,
+                        "category": template.category,
+                        "destination": template.destination,
+                        "amount": template.amount,
+                        "is_shared": template.is_shared,
+                        "description": "Регулярная трата",
+                        "created_at": template.next_run_at
+                    })
+                template.next_run_at = _next_run_at(template)
+        return expenses
+
+    @staticmethod
+    async def _post(session: AsyncSession, expenses: list[dict]):
+        # Счета блокируются до вставки, по порядку ID: строки получают ID с прошедшим
+        # created_at, и write_checkpoint не должен сдвинуть снимок за них до фиксации.
+        await session.execute(
+            select(Wallet.id)
+            .where(Wallet.id.in_({row["wallet_id"] for row in expenses}))
+            .order_by(Wallet.id)
+            .with_for_update()
+        )
+        await session.execute(insert(Expense), expenses)
+
+        balances = defaultdict(Decimal)
+        totals = defaultdict(lambda: (Decimal(0), 0))
+        counts = defaultdict(int)
+        for row in expenses:
+            wallet_id, category = row["wallet_id"], row["category"]
+            balances[wallet_id] += row["amount"]
+            key = (wallet_id, to_moscow(row["created_at"]).date(), category)
+            amount, count = totals[key]
+            totals[key] = (amount + row["amount"], count + 1)
+            counts[wallet_id, category] += 1
+
+        await session.execute(UPDATE_BALANCE, [
+            {"wallet": wallet_id, "amount": amount} for wallet_id, amount in balances.items()
+        ])
+        await apply_expense_totals_many(session, totals)
+        await category_index.record_counts_many(session, counts)
@@ -0,0 +1,130 @@
+from datetime import date
+from decimal import Decimal
+
+from sqlalchemy import select, func, text
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.ext.asyncio import AsyncSession, AsyncConnection
+
+from database.models import Expense, Income, ExpenseDailyRollup, IncomeDailyRollup
+from utils.dates import to_moscow
+
+MAX_RANGE_DAYS = 366
+# Строка агрегата — 5 параметров запроса; пачки держатся далеко от лимита asyncpg (32767).
+ROLLUP_UPSERT_BATCH = 1000
+
+# Заполняет дневные агрегаты по уже существующей истории. Выполняется только пока таблица
+# агрегатов пуста, дальше агрегаты поддерживаются при каждой записи в журнал.
+BACKFILL_EXPENSE_ROLLUPS = text("""
+    INSERT INTO expense_daily_rollups (wallet_id, day, category, amount, count)
+    SELECT wallet_id, (created_at AT TIME ZONE 'UTC' AT TIME ZONE 'Europe/Moscow')::date, category,
+           SUM(amount), COUNT(*)
+    FROM expenses
+    WHERE NOT EXISTS (SELECT 1 FROM expense_daily_rollups)
+    GROUP BY 1, 2, 3
+""")
+
+BACKFILL_INCOME_ROLLUPS = text("""
+    INSERT INTO income_daily_rollups (wallet_id, day, amount, count)
+    SELECT wallet_id, (created_at AT TIME ZONE 'UTC' AT TIME ZONE 'Europe/Moscow')::date, SUM(amount), COUNT(*)
+    FROM incomes
+    WHERE NOT EXISTS (SELECT 1 FROM income_daily_rollups)
+    GROUP BY 1, 2
+""")
+
+
+async def backfill_rollups(conn: AsyncConnection):
+    await conn.execute(BACKFILL_EXPENSE_ROLLUPS)
+    await conn.execute(BACKFILL_INCOME_ROLLUPS)
+
+
+async def apply_expense(session: AsyncSession, expense: Expense, sign: int = 1):
+    """Учитывает трату в дневном агрегате; sign=-1 при удалении."""
+    if expense.created_at is None:
+        await session.flush()
+    day = to_moscow(expense.created_at).date()
+    await apply_expense_totals(session, expense.wallet_id, {(day, expense.category): (expense.amount * sign, sign)})
+
+
+async def apply_income(session: AsyncSession, income: Income, sign: int = 1):
+    """Учитывает пополнение в дневном агрегате; sign=-1 при удалении."""
+    if income.created_at is None:
+        await session.flush()
+    day = to_moscow(income.created_at).date()
+    await apply_income_totals(session, income.wallet_id, {day: (income.amount * sign, sign)})
+
+
+async def apply_expense_totals(session: AsyncSession, wallet_id: int,
+                               totals: dict[tuple[date, str], tuple[Decimal, int]]):
+    """Добавляет к агрегатам суммы и количества трат по ключам (день, категория)."""
+    await apply_expense_totals_many(session, {
+        (wallet_id, day, category): value for (day, category), value in totals.items()
+    })
+
+
+async def apply_expense_totals_many(session: AsyncSession,
+                                    totals: dict[tuple[int, date, str], tuple[Decimal, int]]):
+    """То же для нескольких счетов сразу: ключи (счёт, день, категория)."""
+    rows = [
+        {"wallet_id": wallet_id, "day": day, "category": category, "amount": amount, "count": count}
+        for (wallet_id, day, category), (amount, count) in totals.items()
+    ]
+    for i in range(0, len(rows), ROLLUP_UPSERT_BATCH):
+        stmt = insert(ExpenseDailyRollup).values(rows[i:i + ROLLUP_UPSERT_BATCH])
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[ExpenseDailyRollup.wallet_id, ExpenseDailyRollup.day, ExpenseDailyRollup.category],
+            set_={
+                "amount": ExpenseDailyRollup.amount + stmt.excluded.amount,
+                "count": ExpenseDailyRollup.count + stmt.excluded.count
+            }
+        )
+        await session.execute(stmt)
+
+
+async def apply_income_totals(session: AsyncSession, wallet_id: int, totals: dict[date, tuple[Decimal, int]]):
+    """Добавляет к агрегатам суммы и количества пополнений по дням."""
+    rows = [
+        {"wallet_id": wallet_id, "day": day, "amount": amount, "count": count}
+        for day, (amount, count) in totals.items()
+    ]
+    for i in range(0, len(rows), ROLLUP_UPSERT_BATCH):
+        stmt = insert(IncomeDailyRollup).values(rows[i:i + ROLLUP_UPSERT_BATCH])
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[IncomeDailyRollup.wallet_id, IncomeDailyRollup.day],
+            set_={
+                "amount": IncomeDailyRollup.amount + stmt.excluded.amount,
+                "count": IncomeDailyRollup.count + stmt.excluded.count
+            }
+        )
+        await session.execute(stmt)
+
+
+async def expense_rollups(session: AsyncSession, wallet_id: int, start: date, end: date):
+    """Строки (day, category, amount) за период включительно, O(дней × категорий)."""
+    stmt = select(ExpenseDailyRollup.day, ExpenseDailyRollup.category, ExpenseDailyRollup.amount).where(
+        ExpenseDailyRollup.wallet_id == wallet_id,
+        ExpenseDailyRollup.day.between(start, end),
+        ExpenseDailyRollup.count > 0
+    ).order_by(ExpenseDailyRollup.day)
+    return (await session.execute(stmt)).all()
+
+
+async def expense_category_totals(session: AsyncSession, wallet_id: int):
+    """Строки (category, amount) за всё время, включая архивные секции журнала."""
+    stmt = select(ExpenseDailyRollup.category, func.sum(ExpenseDailyRollup.amount)).where(
+        ExpenseDailyRollup.wallet_id == wallet_id
+    ).group_by(ExpenseDailyRollup.category).having(func.sum(ExpenseDailyRollup.count) > 0)
+    return (await session.execute(stmt)).all()
+
+
+async def income_total(session: AsyncSession, wallet_id: int, start: date | None = None,
+                       end: date | None = None) -> Decimal:
+    stmt = select(func.coalesce(func.sum(IncomeDailyRollup.amount), 0)).where(IncomeDailyRollup.wallet_id == wallet_id)
+    if start is not None and end is not None:
+        stmt = stmt.where(IncomeDailyRollup.day.between(start, end))
+    return Decimal((await session.execute(stmt)).scalar_one())
+
+
+async def expense_total(session: AsyncSession, wallet_id: int) -> Decimal:
+    """Сумма трат за всё время, включая архивные секции журнала."""
+    stmt = select(func.coalesce(func.sum(ExpenseDailyRollup.amount), 0)).where(ExpenseDailyRollup.wallet_id == wallet_id)
+    return Decimal((await session.execute(stmt)).scalar_one())
@@ -0,0 +1,28 @@
+from sqlalchemy import select, literal_column
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from database.models import Expense
+
+SEARCH_PAGE_SIZE = 10
+# Триграммный индекс не помогает при запросах короче трёх символов.
+MIN_QUERY_LENGTH = 3
+MAX_QUERY_LENGTH = 100
+
+# Должно побуквенно совпадать с выражением индекса ix_expenses_search_trgm (миграция 3),
+# иначе планировщик не узнает индекс.
+SEARCH_DOCUMENT_SQL = "(category || ' ' || destination || ' ' || coalesce(description, ''))"
+
+
+def escape_like(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+
+
+async def search_expenses(session: AsyncSession, wallet_id: int, query: str,
+                          page: int) -> tuple[list[Expense], bool]:
+    """Траты счёта, где запрос встречается в категории, назначении или описании; новые сначала."""
+    stmt = select(Expense).where(
+        Expense.wallet_id == wallet_id,
+        literal_column(SEARCH_DOCUMENT_SQL).ilike(f"%{escape_like(query)}%", escape="\\")
+    ).order_by(Expense.created_at.desc(), Expense.id.desc()).offset(page * SEARCH_PAGE_SIZE).limit(SEARCH_PAGE_SIZE + 1)
+    expenses = list((await session.execute(stmt)).scalars().all())
+    return expenses[:SEARCH_PAGE_SIZE], len(expenses) > SEARCH_PAGE_SIZE
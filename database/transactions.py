@@ -0,0 +1,28 @@
+from typing import Callable
+
+from sqlalchemy import event
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+
+AFTER_COMMIT_KEY = "after_commit"
+
+
+def after_commit(session: AsyncSession, callback: Callable[[], None]):
+    """
+    Выполняет callback после фиксации текущей транзакции сессии; при откате он отбрасывается.
+
+    Нужен для кэшей в памяти процесса: изменение, сделанное до фиксации, осталось бы в кэше
+    и после отката.
+    """
+    session.sync_session.info.setdefault(AFTER_COMMIT_KEY, []).append(callback)
+
+
+@event.listens_for(Session, "after_commit")
+def _run_after_commit(session: Session):
+    for callback in session.info.pop(AFTER_COMMIT_KEY, []):
+        callback()
+
+
+@event.listens_for(Session, "after_rollback")
+def _drop_after_commit(session: Session):
+    session.info.pop(AFTER_COMMIT_KEY, None)
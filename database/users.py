@@ -0,0 +1,80 @@
+import asyncio
+import logging
+
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.ext.asyncio import async_sessionmaker
+
+from database.db import async_session_maker
+from database.models import User
+
+logger = logging.getLogger(__name__)
+
+USER_FLUSH_INTERVAL = 0.005
+
+
+class UserRegistry:
+    """
+    Пакетная регистрация пользователей.
+
+    Новые и изменившиеся профили копятся в буфере и раз в несколько миллисекунд
+    записываются одним INSERT ... ON CONFLICT DO UPDATE. Уже записанные профили
+    запоминаются в памяти, и для них обращения к БД не происходит.
+    """
+
+    def __init__(self, session_maker: async_sessionmaker, flush_interval: float = USER_FLUSH_INTERVAL):
+        self._session_maker = session_maker
+        self._flush_interval = flush_interval
+        self._known: dict[int, tuple[str | None, str]] = {}
+        self._pending: dict[int, tuple[str | None, str]] = {}
+        self._waiters: list[asyncio.Future] = []
+        self._flush_task: asyncio.Task | None = None
+
+    async def register(self, user_id: int, username: str | None, first_name: str | None):
+        """Гарантирует, что пользователь записан в БД к моменту возврата."""
+        profile = (username, first_name or "User")
+        if self._known.get(user_id) == profile:
+            return
+
+        self._pending[user_id] = profile
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        if self._flush_task is None:
+            self._flush_task = asyncio.create_task(self._flush_later())
+        await asyncio.shield(waiter)
+
+    async def _flush_later(self):
+        await asyncio.sleep(self._flush_interval)
+        pending, self._pending = self._pending, {}
+        waiters, self._waiters = self._waiters, []
+        self._flush_task = None
+
+        try:
+            await self._upsert(pending)
+        except Exception as e:
+            logger.exception("Не удалось сохранить пользователей: %s", e)
+            for waiter in waiters:
+                if not waiter.done():
+                    waiter.set_exception(e)
+            return
+
+        self._known.update(pending)
+        for waiter in waiters:
+            if not waiter.done():
+                waiter.set_result(None)
+
+    async def _upsert(self, profiles: dict[int, tuple[str | None, str]]):
+        rows = [
+            {"id": user_id, "username": username, "first_name": first_name}
+            for user_id, (username, first_name) in profiles.items()
+        ]
+        stmt = insert(User).values(rows)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[User.id],
+            set_={"username": stmt.excluded.username, "first_name": stmt.excluded.first_name}
+        )
+        async with self._session_maker() as session:
+            await session.execute(stmt)
+            await session.commit()
+
+
+user_registry = UserRegistry(async_session_maker)
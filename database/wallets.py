@@ -0,0 +1,77 @@
+import asyncio
+import logging
+
+from sqlalchemy import select, delete
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker
+
+from database.models import Wallet, Income, Expense
+
+logger = logging.getLogger(__name__)
+
+WALLET_PURGE_INTERVAL = 30
+WALLET_PURGE_BATCH = 5000
+
+
+async def get_wallet(session: AsyncSession, wallet_id: int) -> Wallet | None:
+    """Счёт по ID; удалённый счёт, ожидающий очистки, считается несуществующим."""
+    wallet = await session.get(Wallet, wallet_id)
+    if wallet is None or wallet.deleted_at is not None:
+        return None
+    return wallet
+
+
+async def _delete_batch(session_maker: async_sessionmaker, model: type[Income] | type[Expense],
+                        wallet_id: int, batch_size: int) -> int:
+    batch = select(model.id).where(model.wallet_id == wallet_id).limit(batch_size)
+    async with session_maker() as session:
+        async with session.begin():
+            result = await session.execute(
+                delete(model).where(model.wallet_id == wallet_id, model.id.in_(batch))
+            )
+    return result.rowcount
+
+
+async def purge_wallet(session_maker: async_sessionmaker, wallet_id: int, batch_size: int) -> int:
+    """
+    Удаляет журнал счёта пачками по batch_size строк, каждая в своей короткой транзакции,
+    затем сам счёт. Участники, дневные агрегаты и снимки удаляются каскадом в БД.
+    """
+    removed = 0
+    for model in (Expense, Income):
+        while deleted := await _delete_batch(session_maker, model, wallet_id, batch_size):
+            removed += deleted
+            await asyncio.sleep(0)
+
+    async with session_maker() as session:
+        async with session.begin():
+            await session.execute(delete(Wallet).where(Wallet.id == wallet_id, Wallet.deleted_at.is_not(None)))
+    return removed
+
+
+class WalletPurger:
+    """Фоновая задача: очищает счета, помеченные удалёнными."""
+
+    def __init__(self, session_maker: async_sessionmaker, batch_size: int = WALLET_PURGE_BATCH,
+                 interval: float = WALLET_PURGE_INTERVAL):
+        self.session_maker = session_maker
+        self.batch_size = batch_size
+        self.interval = interval
+
+    async def run(self):
+        while True:
+            try:
+                await self.tick()
+            except Exception as e:
+                logger.exception("Ошибка очистки удалённых счетов: %s", e)
+            await asyncio.sleep(self.interval)
+
+    async def tick(self) -> int:
+        async with self.session_maker() as session:
+            wallet_ids = (await session.execute(
+                select(Wallet.id).where(Wallet.deleted_at.is_not(None)).order_by(Wallet.deleted_at)
+            )).scalars().all()
+
+        for wallet_id in wallet_ids:
+            removed = await purge_wallet(self.session_maker, wallet_id, self.batch_size)
+            logger.info("Счёт #%s очищен, удалено строк журнала: %s", wallet_id, removed)
+        return len(wallet_ids)
@@ -1,6 +1,8 @@
+import asyncio
 import json
 import logging
 from decimal import Decimal, InvalidOperation
+from datetime import date, datetime, timezone
 from collections import defaultdict
 import tempfile
 import os
@@ -8,23 +10,49 @@ import os
 from maxapi import Dispatcher, F, Bot
 from maxapi.types import MessageCreated, Command, Message, MessageCallback, BotStarted, InputMedia
 from maxapi.context import MemoryContext
+from maxapi.enums.attachment import AttachmentType
 from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import selectinload
-import pytz
 
-from database.db import async_session_maker
-from database.models import User, Wallet, WalletMember, Income, Expense
+from database.db import read_query
+from database.categories import category_index
+from database.dashboard import net_positions
+from database.imports import archive_cutoff, ensure_import_partitions, import_ledger
+from database.ledger import load_positions, retract_from_checkpoint
+from database.models import Wallet, WalletMember, Income, Expense, RecurringExpense
+from database.recurring import RECURRING_HOUR, first_run_at
+from database.search import MIN_QUERY_LENGTH, MAX_QUERY_LENGTH, SEARCH_PAGE_SIZE, search_expenses
+from database.wallets import get_wallet
+from database.rollups import (
+    MAX_RANGE_DAYS, apply_expense, apply_income, expense_rollups, expense_category_totals, expense_total, income_total
+)
 from keyboards.inline import (
     main_menu_kb, wallets_list_kb, wallet_menu_kb,
-    confirm_delete_kb, back_to_main_menu_kb, is_shared_expense_kb,
+    confirm_delete_kb, back_to_main_menu_kb, is_shared_expense_kb, stats_period_kb, search_results_kb,
+    expense_categories_kb, recurring_list_kb,
     incomes_list_kb, expenses_list_kb, confirm_delete_transaction_kb, membership_request_kb
 )
-from states.forms import WalletForm, TransactionForm
-from utils.pdf_stats import generate_pdf
+from states.forms import WalletForm, TransactionForm, StatsForm, SearchForm, ImportForm, RecurringForm
+from utils.dates import to_moscow, moscow_today, week_range, month_range, parse_date_range
+from utils.csv_import import CsvImportError, download_csv, parse_csv
+from utils.debts import settle_balances
+from utils.notifications import wallet_notifier
 
 logger = logging.getLogger(__name__)
 
-MOSCOW_TZ = pytz.timezone("Europe/Moscow")
+# Списки операций листаются страницами по created_at: секции журнала читаются от новых
+# к старым, и запрос останавливается, не доходя до старых месяцев.
+LIST_LIMIT = 30
+IMPORT_ERRORS_SHOWN = 20
+
+IMPORT_HELP = (
+    "Пришлите CSV-файл с операциями. Первая строка — заголовки столбцов, разделитель «;» или «,»:\n"
+    "`Дата;Тип;Сумма;Категория;Назначение;Описание;Общая`\n"
+    "`05.09.2025;расход;1250,50;Продукты;Пятёрочка;;да`\n"
+    "`01.09.2025;доход;50000;;;Зарплата;`\n\n"
+    "Обязательны дата, тип («расход» или «доход») и сумма; для расходов ещё категория."
+)
 
 
 async def show_main_menu(message: Message | None, context: MemoryContext, bot: Bot = None, user_id: int = None):
@@ -40,6 +68,67 @@ async def show_main_menu(message: Message | None, context: MemoryContext, bot: B
         await bot.send_message(user_id=user_id, text=text, attachments=attachments)
 
 
+async def build_period_stats(wallet_id: int, start: date, end: date) -> str | None:
+    """Статистика за период по дневным агрегатам; None, если счёт не найден."""
+    async def load(session: AsyncSession):
+        wallet = await get_wallet(session, wallet_id)
+        if not wallet:
+            return None
+        rows = await expense_rollups(session, wallet_id, start, end)
+        return wallet, rows, await income_total(session, wallet_id, start, end)
+
+    loaded = await read_query(load)
+    if loaded is None:
+        return None
+    wallet, rows, total_income = loaded
+
+    # Для периодов длиннее месяца ряд строится по месяцам, чтобы сообщение оставалось коротким.
+    by_month = (end - start).days >= 31
+    expenses_by_cat = defaultdict(Decimal)
+    expenses_by_day = defaultdict(Decimal)
+    for day, category, amount in rows:
+        expenses_by_cat[category] += amount
+        expenses_by_day[day.replace(day=1) if by_month else day] += amount
+    total_expense = sum(expenses_by_cat.values(), Decimal(0))
+
+    stats_msg = f"📊 **Статистика по счёту «{wallet.name}» за {start:%d.%m.%Y} – {end:%d.%m.%Y}**\n\n"
+    stats_msg += f"⬆️ **Поступления:** `{total_income}` ₽\n"
+    stats_msg += f"⬇️ **Траты:** `{total_expense}` ₽\n⎯⎯⎯⎯⎯⎯⎯⎯⎯⎯⎯⎯⎯⎯⎯⎯\n"
+    if expenses_by_cat:
+        stats_msg += "📁 **Траты по категориям:**\n"
+        for cat, amount in sorted(expenses_by_cat.items(), key=lambda i: i[1], reverse=True):
+            perc = (amount / total_expense) * 100 if total_expense else Decimal(0)
+            stats_msg += f"  - `{cat}`: {amount} ₽ ({perc:.1f}%)\n"
+        stats_msg += "📆 **Траты по месяцам:**\n" if by_month else "📆 **Траты по дням:**\n"
+        for day, amount in sorted(expenses_by_day.items()):
+            stats_msg += f"  - {day:%m.%Y}: {amount} ₽\n" if by_month else f"  - {day:%d.%m}: {amount} ₽\n"
+    else:
+        stats_msg += "Трат за этот период нет."
+    return stats_msg
+
+
+async def build_search_results(wallet_id: int, query: str, page: int) -> tuple[str, bool] | None:
+    """Страница результатов поиска трат и признак следующей страницы; None, если счёт не найден."""
+    async def load(session: AsyncSession):
+        if not await get_wallet(session, wallet_id):
+            return None
+        return await search_expenses(session, wallet_id, query, page)
+
+    found = await read_query(load)
+    if found is None:
+        return None
+    expenses, has_more = found
+
+    text = f"🔍 **Поиск «{query}» в счёте #{wallet_id}**\n\n"
+    if not expenses:
+        return text + ("Ничего не найдено." if page == 0 else "Больше результатов нет."), False
+    for number, expense in enumerate(expenses, start=page * SEARCH_PAGE_SIZE + 1):
+        date_str = to_moscow(expense.created_at).strftime("%d.%m.%Y")
+        shared_marker = "👥" if expense.is_shared else "👤"
+        text += f"{number}. {date_str} | `{expense.category}` | {expense.destination} | {expense.amount} ₽ {shared_marker}\n"
+    return text, has_more
+
+
 async def register_handlers(dp: Dispatcher):
     @dp.bot_started()
     async def on_bot_start(event: BotStarted, context: MemoryContext):
@@ -61,26 +150,43 @@ async def register_handlers(dp: Dispatcher):
         await show_main_menu(message=None, user_id=event.from_user.user_id, context=context, bot=event.bot)
 
     @dp.message_callback(F.callback.payload.func(lambda p: json.loads(p).get("menu") == "my_wallets"))
-    async def show_user_wallets(event: MessageCallback, context: MemoryContext):
+    async def show_user_wallets(event: MessageCallback, context: MemoryContext, session: AsyncSession):
         user_id = event.from_user.user_id
-        async with async_session_maker() as session:
-            owned_q = select(Wallet).where(Wallet.owner_id == user_id)
-            member_q = select(Wallet).join(WalletMember).where(WalletMember.user_id == user_id)
-            owned_wallets = (await session.execute(owned_q)).scalars().all()
-            member_wallets = (await session.execute(member_q)).scalars().all()
-            all_wallets = sorted(list(set(owned_wallets + member_wallets)), key=lambda w: w.id)
+        owned_q = select(Wallet).where(Wallet.owner_id == user_id, Wallet.deleted_at.is_(None))
+        member_q = select(Wallet).join(WalletMember).where(WalletMember.user_id == user_id,
+                                                           Wallet.deleted_at.is_(None))
+        owned_wallets = (await session.execute(owned_q)).scalars().all()
+        member_wallets = (await session.execute(member_q)).scalars().all()
+        all_wallets = sorted(list(set(owned_wallets + member_wallets)), key=lambda w: w.id)
 
         if not all_wallets:
             await event.message.edit("У вас пока нет счетов.", attachments=[back_to_main_menu_kb()])
             return
         await event.message.edit("Выберите счёт для управления:", attachments=[wallets_list_kb(all_wallets)])
 
+    @dp.message_callback(F.callback.payload.func(lambda p: json.loads(p).get("menu") == "my_total"))
+    async def show_my_total(event: MessageCallback, context: MemoryContext, session: AsyncSession):
+        positions = await net_positions.get(session, event.from_user.user_id)
+        if not positions:
+            await event.message.edit("У вас пока нет счетов.", attachments=[back_to_main_menu_kb()])
+            return
+
+        lines = ["📊 Ваш итог по всем счетам:\n"]
+        for pos in positions:
+            lines.append(
+                f"Счёт #{pos.wallet_id} «{pos.name}»: {pos.balance:+.2f} ₽\n"
+                f"  внесено {pos.paid} ₽, лично потрачено {pos.personal_spent} ₽, "
+                f"доля общих трат {pos.shared_share:.2f} ₽"
+            )
+        total = sum(pos.balance for pos in positions)
+        lines.append(f"\nИтого: {total:+.2f} ₽ (плюс — вам должны, минус — должны вы)")
+        await event.message.edit("\n".join(lines), attachments=[back_to_main_menu_kb()])
+
     @dp.message_callback(F.callback.payload.func(lambda p: json.loads(p).get("action") == "open_wallet"))
-    async def open_wallet_menu(event: MessageCallback, context: MemoryContext):
+    async def open_wallet_menu(event: MessageCallback, context: MemoryContext, session: AsyncSession):
         payload = json.loads(event.callback.payload)
         wallet_id = payload['wallet_id']
-        async with async_session_maker() as session:
-            wallet = await session.get(Wallet, wallet_id)
+        wallet = await get_wallet(session, wallet_id)
         if not wallet:
             await event.message.edit("Ошибка: счёт не найден.", attachments=[back_to_main_menu_kb()])
             return
@@ -94,7 +200,7 @@ async def register_handlers(dp: Dispatcher):
         await event.message.edit("Введите название для нового счёта:", attachments=[back_to_main_menu_kb()])
 
     @dp.message_created(WalletForm.creating_name)
-    async def new_wallet_name_provided(event: MessageCreated, context: MemoryContext):
+    async def new_wallet_name_provided(event: MessageCreated, context: MemoryContext, session: AsyncSession):
         wallet_name = event.message.body.text
         if not wallet_name or len(wallet_name) > 100:
             await event.message.answer("Название некорректно, попробуйте ещё раз.",
@@ -102,18 +208,14 @@ async def register_handlers(dp: Dispatcher):
             return
 
         user_id = event.message.sender.user_id
-        async with async_session_maker() as session:
-            user = await session.get(User, user_id)
-            if not user:
-                user = User(id=user_id, first_name=getattr(event.message.sender, 'first_name', "User"))
-                session.add(user)
-            wallet = Wallet(name=wallet_name, owner_id=user_id)
-            session.add(wallet)
-            await session.commit()
-            member = WalletMember(wallet_id=wallet.id, user_id=user_id)
-            session.add(member)
-            await session.commit()
-            await event.message.answer(f"✅ Счёт «{wallet.name}» успешно создан! Его ID: `{wallet.id}`")
+        wallet = Wallet(name=wallet_name, owner_id=user_id)
+        session.add(wallet)
+        await session.flush()
+        member = WalletMember(wallet_id=wallet.id, user_id=user_id)
+        session.add(member)
+        await session.commit()
+        net_positions.invalidate_user(user_id)
+        await event.message.answer(f"✅ Счёт «{wallet.name}» успешно создан! Его ID: `{wallet.id}`")
         await show_main_menu(message=None, user_id=event.from_user.user_id, context=context, bot=event.bot)
 
     @dp.message_callback(F.callback.payload.func(lambda p: json.loads(p).get("menu") == "connect_wallet"))
@@ -127,7 +229,7 @@ async def register_handlers(dp: Dispatcher):
         await event.message.edit("Пришлите ID счёта для присоединения:", attachments=[back_to_main_menu_kb()])
 
     @dp.message_created(WalletForm.connecting_id)
-    async def connect_wallet_id_provided(event: MessageCreated, context: MemoryContext):
+    async def connect_wallet_id_provided(event: MessageCreated, context: MemoryContext, session: AsyncSession):
         try:
             wallet_id = int(event.message.body.text)
         except (ValueError, TypeError):
@@ -136,20 +238,19 @@ async def register_handlers(dp: Dispatcher):
             return
 
         user_id = event.message.sender.user_id
-        async with async_session_maker() as session:
-            wallet = await session.get(Wallet, wallet_id)
-            if not wallet:
-                await event.message.answer("Счёт с таким ID не найден.", attachments=[back_to_main_menu_kb()])
-                return
-            if wallet.owner_id == user_id:
-                await event.message.answer("👑 Вы владелец этого счёта.", attachments=[back_to_main_menu_kb()])
-                return
-            existing = await session.execute(
-                select(WalletMember).where(WalletMember.wallet_id == wallet_id, WalletMember.user_id == user_id)
-            )
-            if existing.scalar_one_or_none():
-                await event.message.answer("⚠️ Вы уже участник этого счёта.", attachments=[back_to_main_menu_kb()])
-                return
+        wallet = await get_wallet(session, wallet_id)
+        if not wallet:
+            await event.message.answer("Счёт с таким ID не найден.", attachments=[back_to_main_menu_kb()])
+            return
+        if wallet.owner_id == user_id:
+            await event.message.answer("👑 Вы владелец этого счёта.", attachments=[back_to_main_menu_kb()])
+            return
+        existing = await session.execute(
+            select(WalletMember).where(WalletMember.wallet_id == wallet_id, WalletMember.user_id == user_id)
+        )
+        if existing.scalar_one_or_none():
+            await event.message.answer("⚠️ Вы уже участник этого счёта.", attachments=[back_to_main_menu_kb()])
+            return
 
         owner_id = wallet.owner_id
         requester_name = event.message.sender.first_name or str(user_id)
@@ -163,20 +264,24 @@ async def register_handlers(dp: Dispatcher):
         await context.clear()
 
     @dp.message_callback(F.callback.payload.func(lambda p: json.loads(p).get("action") == "accept_member"))
-    async def accept_member(event: MessageCallback, context: MemoryContext):
+    async def accept_member(event: MessageCallback, context: MemoryContext, session: AsyncSession):
         payload = json.loads(event.callback.payload)
         requester_id = payload["requester_id"]
         wallet_id = payload["wallet_id"]
-        async with async_session_maker() as session:
-            existing = await session.execute(
-                select(WalletMember).where(WalletMember.wallet_id == wallet_id, WalletMember.user_id == requester_id)
-            )
-            if existing.scalar_one_or_none():
-                await event.message.edit("Пользователь уже добавлен ранее.")
-                return
-            member = WalletMember(wallet_id=wallet_id, user_id=requester_id)
-            session.add(member)
-            await session.commit()
+        if not await get_wallet(session, wallet_id):
+            await event.message.edit("❌ Счёт не найден.")
+            return
+        existing = await session.execute(
+            select(WalletMember).where(WalletMember.wallet_id == wallet_id, WalletMember.user_id == requester_id)
+        )
+        if existing.scalar_one_or_none():
+            await event.message.edit("Пользователь уже добавлен ранее.")
+            return
+        member = WalletMember(wallet_id=wallet_id, user_id=requester_id)
+        session.add(member)
+        await session.commit()
+        net_positions.invalidate_wallet(wallet_id)
+        net_positions.invalidate_user(requester_id)
         await event.message.edit("Пользователь добавлен!")
         await event.bot.send_message(
             user_id=requester_id,
@@ -198,68 +303,230 @@ async def register_handlers(dp: Dispatcher):
     async def wallet_stats_handler(event: MessageCallback, context: MemoryContext):
         payload = json.loads(event.callback.payload)
         wallet_id = payload['wallet_id']
-        async with async_session_maker() as session:
-            stmt = select(Wallet).where(Wallet.id == wallet_id).options(
-                selectinload(Wallet.incomes).selectinload(Income.user),
-                selectinload(Wallet.expenses).selectinload(Expense.user),
-                selectinload(Wallet.members).selectinload(WalletMember.user),
-                selectinload(Wallet.owner)
-            )
-            wallet = (await session.execute(stmt)).scalar_one_or_none()
+
+        async def load(session: AsyncSession):
+            wallet = await get_wallet(session, wallet_id)
             if not wallet:
-                await event.message.edit("❌ Счёт не найден.", attachments=[back_to_main_menu_kb()])
-                return
-
-            total_income = sum(i.amount for i in wallet.incomes)
-            total_expense = sum(e.amount for e in wallet.expenses)
-            expenses_by_cat = defaultdict(Decimal)
-            for exp in wallet.expenses: expenses_by_cat[exp.category] += exp.amount
-
-            stats_msg = f"📊 **Статистика по счёту «{wallet.name}» (ID: {wallet.id})**\n\n"
-            stats_msg += f"🏦 **Текущий баланс:** `{wallet.balance}` ₽\n"
-            stats_msg += f"⬆️ **Всего поступлений:** `{total_income}` ₽\n"
-            stats_msg += f"⬇️ **Всего трат:** `{total_expense}` ₽\n⎯⎯⎯⎯⎯⎯⎯⎯⎯⎯⎯⎯⎯⎯⎯⎯\n"
-            if expenses_by_cat:
-                stats_msg += "📁 **Траты по категориям:**\n"
-                for cat, amount in sorted(expenses_by_cat.items(), key=lambda i: i[1], reverse=True):
-                    perc = (amount / total_expense) * 100 if total_expense else Decimal(0)
-                    stats_msg += f"  - `{cat}`: {amount} ₽ ({perc:.1f}%)\n"
-
-            await event.message.edit(stats_msg, attachments=[
-                wallet_menu_kb(wallet_id, wallet.owner_id == event.from_user.user_id)])
+                return None
+            return wallet, await income_total(session, wallet_id), await expense_category_totals(session, wallet_id)
+
+        loaded = await read_query(load)
+        if loaded is None:
+            await event.message.edit("❌ Счёт не найден.", attachments=[back_to_main_menu_kb()])
+            return
+        wallet, total_income, category_totals = loaded
+
+        expenses_by_cat = dict(category_totals)
+        total_expense = sum(expenses_by_cat.values(), Decimal(0))
+
+        stats_msg = f"📊 **Статистика по счёту «{wallet.name}» (ID: {wallet.id})**\n\n"
+        stats_msg += f"🏦 **Текущий баланс:** `{wallet.balance}` ₽\n"
+        stats_msg += f"⬆️ **Всего поступлений:** `{total_income}` ₽\n"
+        stats_msg += f"⬇️ **Всего трат:** `{total_expense}` ₽\n⎯⎯⎯⎯⎯⎯⎯⎯⎯⎯⎯⎯⎯⎯⎯⎯\n"
+        if expenses_by_cat:
+            stats_msg += "📁 **Траты по категориям:**\n"
+            for cat, amount in sorted(expenses_by_cat.items(), key=lambda i: i[1], reverse=True):
+                perc = (amount / total_expense) * 100 if total_expense else Decimal(0)
+                stats_msg += f"  - `{cat}`: {amount} ₽ ({perc:.1f}%)\n"
+
+        await event.message.edit(stats_msg, attachments=[stats_period_kb(wallet_id)])
+
+    @dp.message_callback(F.callback.payload.func(lambda p: json.loads(p).get("action") == "stats_period"))
+    async def wallet_period_stats(event: MessageCallback, context: MemoryContext):
+        payload = json.loads(event.callback.payload)
+        wallet_id = payload['wallet_id']
+        today = moscow_today()
+        start, end = week_range(today) if payload['period'] == "week" else month_range(today)
+
+        stats_msg = await build_period_stats(wallet_id, start, end)
+        if stats_msg is None:
+            await event.message.edit("❌ Счёт не найден.", attachments=[back_to_main_menu_kb()])
+            return
+        await event.message.edit(stats_msg, attachments=[stats_period_kb(wallet_id)])
+
+    @dp.message_callback(F.callback.payload.func(lambda p: json.loads(p).get("action") == "stats_custom"))
+    async def wallet_custom_stats_start(event: MessageCallback, context: MemoryContext, session: AsyncSession):
+        payload = json.loads(event.callback.payload)
+        wallet_id = payload['wallet_id']
+        if not await get_wallet(session, wallet_id):
+            await event.message.edit("❌ Счёт не найден.", attachments=[back_to_main_menu_kb()])
+            return
+        await context.update_data(wallet_id=wallet_id)
+        await context.set_state(StatsForm.entering_range)
+        await event.message.edit("Введите период в формате `01.10.2025-15.10.2025`:",
+                                 attachments=[back_to_main_menu_kb()])
+
+    @dp.message_created(StatsForm.entering_range)
+    async def wallet_custom_stats_provided(event: MessageCreated, context: MemoryContext):
+        date_range = parse_date_range(event.message.body.text or "")
+        if date_range is None or (date_range[1] - date_range[0]).days >= MAX_RANGE_DAYS:
+            await event.message.answer(
+                f"Период некорректен. Формат: `01.10.2025-15.10.2025`, не длиннее {MAX_RANGE_DAYS} дней.",
+                attachments=[back_to_main_menu_kb()])
+            return
+
+        user_data = await context.get_data()
+        wallet_id = user_data.get("wallet_id")
+        await context.clear()
+
+        stats_msg = await build_period_stats(wallet_id, *date_range)
+        if stats_msg is None:
+            await event.message.answer("❌ Счёт не найден.", attachments=[back_to_main_menu_kb()])
+            return
+        await event.message.answer(stats_msg, attachments=[stats_period_kb(wallet_id)])
+
+    @dp.message_callback(F.callback.payload.func(lambda p: json.loads(p).get("action") == "search_expenses"))
+    async def search_expenses_start(event: MessageCallback, context: MemoryContext, session: AsyncSession):
+        payload = json.loads(event.callback.payload)
+        wallet_id = payload['wallet_id']
+        if not await get_wallet(session, wallet_id):
+            await event.message.edit("❌ Счёт не найден.", attachments=[back_to_main_menu_kb()])
+            return
+        await context.update_data(wallet_id=wallet_id)
+        await context.set_state(SearchForm.entering_query)
+        await event.message.edit(
+            f"Введите часть категории, назначения или описания траты (от {MIN_QUERY_LENGTH} символов):",
+            attachments=[back_to_main_menu_kb()])
+
+    @dp.message_created(SearchForm.entering_query)
+    async def search_query_provided(event: MessageCreated, context: MemoryContext):
+        query = (event.message.body.text or "").strip()
+        if not MIN_QUERY_LENGTH <= len(query) <= MAX_QUERY_LENGTH:
+            await event.message.answer(
+                f"Запрос должен быть от {MIN_QUERY_LENGTH} до {MAX_QUERY_LENGTH} символов. Попробуйте снова.",
+                attachments=[back_to_main_menu_kb()])
+            return
+
+        user_data = await context.get_data()
+        wallet_id = user_data.get("wallet_id")
+        # Запрос остаётся в данных контекста для листания страниц кнопками.
+        await context.set_state(None)
+        await context.update_data(search_query=query)
+
+        results = await build_search_results(wallet_id, query, 0)
+        if results is None:
+            await event.message.answer("❌ Счёт не найден.", attachments=[back_to_main_menu_kb()])
+            return
+        text, has_more = results
+        await event.message.answer(text, attachments=[search_results_kb(wallet_id, 0, has_more)])
+
+    @dp.message_callback(F.callback.payload.func(lambda p: json.loads(p).get("action") == "search_page"))
+    async def search_page(event: MessageCallback, context: MemoryContext):
+        payload = json.loads(event.callback.payload)
+        wallet_id = payload['wallet_id']
+        page = payload['page']
+        user_data = await context.get_data()
+        query = user_data.get("search_query")
+        if not query or user_data.get("wallet_id") != wallet_id:
+            await event.answer(notification="⌛ Сессия истекла, начните заново.")
+            await show_main_menu(message=event.message, context=context)
+            return
+
+        results = await build_search_results(wallet_id, query, page)
+        if results is None:
+            await event.message.edit("❌ Счёт не найден.", attachments=[back_to_main_menu_kb()])
+            return
+        text, has_more = results
+        await event.message.edit(text, attachments=[search_results_kb(wallet_id, page, has_more)])
+
+    @dp.message_callback(F.callback.payload.func(lambda p: json.loads(p).get("action") == "import_csv"))
+    async def import_csv_start(event: MessageCallback, context: MemoryContext, session: AsyncSession):
+        payload = json.loads(event.callback.payload)
+        wallet_id = payload['wallet_id']
+        if not await get_wallet(session, wallet_id):
+            await event.message.edit("❌ Счёт не найден.", attachments=[back_to_main_menu_kb()])
+            return
+        await context.update_data(wallet_id=wallet_id)
+        await context.set_state(ImportForm.waiting_file)
+        await event.message.edit(IMPORT_HELP, attachments=[back_to_main_menu_kb()])
+
+    @dp.message_created(ImportForm.waiting_file)
+    async def import_csv_file_provided(event: MessageCreated, context: MemoryContext, session: AsyncSession):
+        attachment = next(
+            (a for a in event.message.body.attachments or [] if a.type == AttachmentType.FILE), None
+        )
+        if attachment is None:
+            await event.message.answer("Пришлите CSV-файл вложением.", attachments=[back_to_main_menu_kb()])
+            return
+
+        user_data = await context.get_data()
+        wallet_id = user_data.get("wallet_id")
+        user_id = event.from_user.user_id
+        # Файл скачивается и разбирается до первого запроса, чтобы не держать соединение с БД.
+        try:
+            stream = await download_csv(attachment.payload.url)
+        except CsvImportError as e:
+            await event.message.answer(f"❌ {e}", attachments=[back_to_main_menu_kb()])
+            return
+        with stream:
+            parsed = await asyncio.to_thread(parse_csv, stream, wallet_id, user_id, archive_cutoff())
+
+        if parsed.errors:
+            text = "❌ Файл не импортирован. Исправьте ошибки и пришлите его снова:\n"
+            text += "\n".join(parsed.errors[:IMPORT_ERRORS_SHOWN])
+            if len(parsed.errors) > IMPORT_ERRORS_SHOWN:
+                text += f"\n… и ещё {len(parsed.errors) - IMPORT_ERRORS_SHOWN}"
+            await event.message.answer(text, attachments=[back_to_main_menu_kb()])
+            return
+        if not parsed.expenses and not parsed.incomes:
+            await event.message.answer("В файле нет операций.", attachments=[back_to_main_menu_kb()])
+            return
+
+        await ensure_import_partitions(parsed)
+        wallet = await get_wallet(session, wallet_id)
+        if not wallet:
+            await context.clear()
+            await event.message.answer("❌ Счёт не найден.", attachments=[back_to_main_menu_kb()])
+            return
+        delta = await import_ledger(session, wallet, parsed)
+        await session.commit()
+        net_positions.invalidate_wallet(wallet_id)
+        await event.message.answer(
+            f"✅ Импортировано трат: {len(parsed.expenses)}, пополнений: {len(parsed.incomes)}.\n"
+            f"Баланс изменён на {delta:+} ₽, теперь {wallet.balance} ₽."
+        )
+        await show_main_menu(message=None, user_id=user_id, context=context, bot=event.bot)
 
     @dp.message_callback(F.callback.payload.func(lambda p: json.loads(p).get("action") == "delete_wallet"))
-    async def delete_wallet_confirm(event: MessageCallback, context: MemoryContext):
+    async def delete_wallet_confirm(event: MessageCallback, context: MemoryContext, session: AsyncSession):
         payload = json.loads(event.callback.payload)
+        wallet_id = payload['wallet_id']
+        if not await get_wallet(session, wallet_id):
+            await event.message.edit("❌ Счёт не найден.", attachments=[back_to_main_menu_kb()])
+            return
         await event.message.edit("Вы уверены, что хотите удалить этот счёт?",
-                                 attachments=[confirm_delete_kb(payload['wallet_id'])])
+                                 attachments=[confirm_delete_kb(wallet_id)])
 
     @dp.message_callback(F.callback.payload.func(lambda p: json.loads(p).get("action") == "confirm_delete"))
-    async def delete_wallet_execute(event: MessageCallback, context: MemoryContext):
+    async def delete_wallet_execute(event: MessageCallback, context: MemoryContext, session: AsyncSession):
         payload = json.loads(event.callback.payload)
         wallet_id = payload['wallet_id']
-        async with async_session_maker() as session:
-            wallet = await session.get(Wallet, wallet_id)
-            if not wallet or wallet.owner_id != event.from_user.user_id:
-                await event.message.edit("❌ Ошибка: счёт не найден или у вас нет прав на удаление.")
-                await show_main_menu(message=None, user_id=event.from_user.user_id, context=context, bot=event.bot)
-                return
-            await session.delete(wallet)
-            await session.commit()
+        wallet = await get_wallet(session, wallet_id)
+        if not wallet or wallet.owner_id != event.from_user.user_id:
+            await event.message.edit("❌ Ошибка: счёт не найден или у вас нет прав на удаление.")
+            await show_main_menu(message=None, user_id=event.from_user.user_id, context=context, bot=event.bot)
+            return
+        # Журнал счёта очищается в фоне (WalletPurger), чтобы не держать хендлер на больших счетах.
+        wallet.deleted_at = datetime.now()
+        await session.commit()
+        net_positions.invalidate_wallet(wallet_id)
         await event.message.edit(f"✅ Счёт #{wallet_id} удалён.")
         await show_main_menu(message=None, user_id=event.from_user.user_id, context=context, bot=event.bot)
 
     @dp.message_callback(F.callback.payload.func(lambda p: json.loads(p).get("action") == "add_capital"))
-    async def add_capital_start(event: MessageCallback, context: MemoryContext):
+    async def add_capital_start(event: MessageCallback, context: MemoryContext, session: AsyncSession):
         payload = json.loads(event.callback.payload)
         wallet_id = payload['wallet_id']
+        if not await get_wallet(session, wallet_id):
+            await event.message.edit("❌ Счёт не найден.", attachments=[back_to_main_menu_kb()])
+            return
         await context.update_data(wallet_id=wallet_id)
         await context.set_state(TransactionForm.entering_capital_amount)
         await event.message.edit(f"Введите сумму для пополнения счёта #{wallet_id}:",
                                  attachments=[back_to_main_menu_kb()])
 
     @dp.message_created(TransactionForm.entering_capital_amount)
-    async def add_capital_amount_provided(event: MessageCreated, context: MemoryContext):
+    async def add_capital_amount_provided(event: MessageCreated, context: MemoryContext, session: AsyncSession):
         try:
             amount = Decimal(event.message.body.text)
             if amount <= 0: raise ValueError
@@ -270,24 +537,40 @@ async def register_handlers(dp: Dispatcher):
 
         user_data = await context.get_data()
         wallet_id = user_data.get("wallet_id")
-        async with async_session_maker() as session:
-            wallet = await session.get(Wallet, wallet_id)
-            wallet.balance += amount
-            income = Income(wallet_id=wallet_id, user_id=event.message.sender.user_id, amount=amount,
-                            description="Пополнение баланса")
-            session.add(income)
-            await session.commit()
-            await event.message.answer(f"✅ Счёт #{wallet_id} пополнен на {amount} ₽.\nНовый баланс: {wallet.balance} ₽")
+        wallet = await get_wallet(session, wallet_id)
+        if not wallet:
+            await context.clear()
+            await event.message.answer("❌ Счёт не найден.", attachments=[back_to_main_menu_kb()])
+            return
+        wallet.balance += amount
+        income = Income(wallet_id=wallet_id, user_id=event.message.sender.user_id, amount=amount,
+                        description="Пополнение баланса")
+        session.add(income)
+        await apply_income(session, income)
+        await session.commit()
+        net_positions.invalidate_wallet(wallet_id)
+        await event.message.answer(f"✅ Счёт #{wallet_id} пополнен на {amount} ₽.\nНовый баланс: {wallet.balance} ₽")
         await show_main_menu(message=None, user_id=event.from_user.user_id, context=context, bot=event.bot)
 
     @dp.message_callback(F.callback.payload.func(lambda p: json.loads(p).get("action") == "add_expense"))
-    async def add_expense_start(event: MessageCallback, context: MemoryContext):
+    async def add_expense_start(event: MessageCallback, context: MemoryContext, session: AsyncSession):
         payload = json.loads(event.callback.payload)
         wallet_id = payload['wallet_id']
+        if not await get_wallet(session, wallet_id):
+            await event.message.edit("❌ Счёт не найден.", attachments=[back_to_main_menu_kb()])
+            return
 
         await context.update_data(wallet_id=wallet_id)
         await context.set_state(TransactionForm.entering_expense_category)
 
+        categories = await category_index.top(session, wallet_id)
+        if categories:
+            await event.message.edit(
+                f"Вы добавляете трату в счёт #{wallet_id}.\n\n"
+                "Выберите категорию или введите новую:",
+                attachments=[expense_categories_kb(categories)]
+            )
+            return
         await event.message.edit(
             f"Вы добавляете трату в счёт #{wallet_id}.\n\n"
             "Введите категорию траты (например, 'Продукты', 'Транспорт', 'Развлечения'):",
@@ -295,17 +578,33 @@ async def register_handlers(dp: Dispatcher):
         )
 
     @dp.message_created(TransactionForm.entering_expense_category)
-    async def expense_category_provided(event: MessageCreated, context: MemoryContext):
+    async def expense_category_provided(event: MessageCreated, context: MemoryContext, session: AsyncSession):
         category = event.message.body.text
-        if not category or len(category) > 100:
+        if not category or not category.strip() or len(category) > 100:
             await event.message.answer("Название категории некорректно. Попробуйте снова.",
                                        attachments=[back_to_main_menu_kb()])
             return
 
+        user_data = await context.get_data()
+        category = await category_index.normalise(session, user_data.get("wallet_id"), category)
         await context.update_data(category=category)
         await context.set_state(TransactionForm.entering_expense_destination)
 
         await event.message.answer(
+            f"Категория: «{category}».\n"
+            "Отлично. Теперь введите назначение траты (например, 'Поход в Пятёрочку', 'Такси до дома'):",
+            attachments=[back_to_main_menu_kb()]
+        )
+
+    @dp.message_callback(F.callback.payload.func(lambda p: "category" in json.loads(p)),
+                         TransactionForm.entering_expense_category)
+    async def expense_category_chosen(event: MessageCallback, context: MemoryContext):
+        category = json.loads(event.callback.payload)["category"]
+        await context.update_data(category=category)
+        await context.set_state(TransactionForm.entering_expense_destination)
+
+        await event.message.edit(
+            f"Категория: «{category}».\n"
             "Отлично. Теперь введите назначение траты (например, 'Поход в Пятёрочку', 'Такси до дома'):",
             attachments=[back_to_main_menu_kb()]
         )
@@ -348,7 +647,7 @@ async def register_handlers(dp: Dispatcher):
         )
 
     @dp.message_callback(TransactionForm.choosing_expense_share_type)
-    async def expense_share_type_chosen(event: MessageCallback, context: MemoryContext):
+    async def expense_share_type_chosen(event: MessageCallback, context: MemoryContext, session: AsyncSession):
         payload = json.loads(event.callback.payload)
         is_shared = payload.get("shared", False)
 
@@ -358,166 +657,386 @@ async def register_handlers(dp: Dispatcher):
         destination = user_data.get("destination")
         amount = Decimal(user_data.get("amount"))
 
-        async with async_session_maker() as session:
-            wallet = await session.get(Wallet, wallet_id)
-            if not wallet:
-                await event.message.edit("❌ Произошла ошибка, счёт не найден.")
-                await show_main_menu(message=None, user_id=event.from_user.user_id, context=context, bot=event.bot)
-                return
-
-            wallet.balance -= amount
-
-            expense = Expense(
-                wallet_id=wallet_id,
-                user_id=event.from_user.user_id,
-                category=category,
-                destination=destination,
-                amount=amount,
-                is_shared=is_shared
-            )
-            session.add(expense)
-            await session.commit()
+        wallet = await get_wallet(session, wallet_id)
+        if not wallet:
+            await event.message.edit("❌ Произошла ошибка, счёт не найден.")
+            await show_main_menu(message=None, user_id=event.from_user.user_id, context=context, bot=event.bot)
+            return
+
+        wallet.balance -= amount
+
+        expense = Expense(
+            wallet_id=wallet_id,
+            user_id=event.from_user.user_id,
+            category=category,
+            destination=destination,
+            amount=amount,
+            is_shared=is_shared
+        )
+        session.add(expense)
+        await apply_expense(session, expense)
+        await category_index.record(session, wallet_id, category)
+        await session.commit()
+        net_positions.invalidate_wallet(wallet_id)
+        # Уведомление ставится в очередь только после фиксации: откаченная трата не попадёт в сводку.
+        if is_shared:
+            author = event.from_user.first_name or str(event.from_user.user_id)
+            wallet_notifier.notify(wallet_id, wallet.name, event.from_user.user_id,
+                                   f"➕ {amount} ₽ · {category} — {destination} ({author})")
+
+        shared_text = "общая" if is_shared else "личная"
+        await event.message.edit(
+            f"✅ Трата добавлена!\n\n"
+            f"Категория: {category}\n"
+            f"Назначение: {destination}\n"
+            f"Сумма: {amount} ₽ ({shared_text})\n\n"
+            f"Новый баланс счёта: {wallet.balance} ₽"
+        )
+
+        await show_main_menu(message=None, user_id=event.from_user.user_id, context=context, bot=event.bot)
+
+    @dp.message_callback(F.callback.payload.func(lambda p: json.loads(p).get("action") == "recurring"))
+    async def show_recurring(event: MessageCallback, context: MemoryContext, session: AsyncSession):
+        payload = json.loads(event.callback.payload)
+        wallet_id = payload['wallet_id']
+        if not await get_wallet(session, wallet_id):
+            await event.message.edit("❌ Счёт не найден.", attachments=[back_to_main_menu_kb()])
+            return
+        user_id = event.from_user.user_id
+
+        templates = (await session.execute(
+            select(RecurringExpense).where(RecurringExpense.wallet_id == wallet_id, RecurringExpense.user_id == user_id)
+            .order_by(RecurringExpense.day_of_month, RecurringExpense.id)
+        )).scalars().all()
+
+        text = f"🔁 **Ваши регулярные траты в счёте #{wallet_id}**\n\n"
+        if templates:
+            text += f"Трата записывается автоматически каждый месяц в указанный день в {RECURRING_HOUR}:00 по Москве.\n\n"
+            text += "Нажмите на кнопку, чтобы удалить регулярную трату:"
+        else:
+            text += "У вас пока нет регулярных трат. Добавьте, например, аренду или подписку."
+        await event.message.edit(text, attachments=[recurring_list_kb(templates, wallet_id)])
+
+    @dp.message_callback(F.callback.payload.func(lambda p: json.loads(p).get("action") == "delete_recurring"))
+    async def delete_recurring(event: MessageCallback, context: MemoryContext, session: AsyncSession):
+        payload = json.loads(event.callback.payload)
+        template = await session.get(RecurringExpense, payload['id'])
+        if not template or template.user_id != event.from_user.user_id:
+            await event.message.edit("❌ Регулярная трата не найдена.", attachments=[back_to_main_menu_kb()])
+            return
+        # Уже записанные по шаблону траты остаются в журнале.
+        await session.delete(template)
+        await session.commit()
+        await show_recurring(event, context, session)
+
+    @dp.message_callback(F.callback.payload.func(lambda p: json.loads(p).get("action") == "add_recurring"))
+    async def add_recurring_start(event: MessageCallback, context: MemoryContext, session: AsyncSession):
+        payload = json.loads(event.callback.payload)
+        wallet_id = payload['wallet_id']
+        if not await get_wallet(session, wallet_id):
+            await event.message.edit("❌ Счёт не найден.", attachments=[back_to_main_menu_kb()])
+            return
+
+        await context.update_data(wallet_id=wallet_id)
+        await context.set_state(RecurringForm.entering_category)
 
-            shared_text = "общая" if is_shared else "личная"
+        categories = await category_index.top(session, wallet_id)
+        if categories:
             await event.message.edit(
-                f"✅ Трата добавлена!\n\n"
-                f"Категория: {category}\n"
-                f"Назначение: {destination}\n"
-                f"Сумма: {amount} ₽ ({shared_text})\n\n"
-                f"Новый баланс счёта: {wallet.balance} ₽"
+                f"Вы добавляете регулярную трату в счёт #{wallet_id}.\n\n"
+                "Выберите категорию или введите новую:",
+                attachments=[expense_categories_kb(categories)]
             )
+            return
+        await event.message.edit(
+            f"Вы добавляете регулярную трату в счёт #{wallet_id}.\n\n"
+            "Введите категорию траты (например, 'Жильё', 'Подписки'):",
+            attachments=[back_to_main_menu_kb()]
+        )
 
+    @dp.message_created(RecurringForm.entering_category)
+    async def recurring_category_provided(event: MessageCreated, context: MemoryContext, session: AsyncSession):
+        category = event.message.body.text
+        if not category or not category.strip() or len(category) > 100:
+            await event.message.answer("Название категории некорректно. Попробуйте снова.",
+                                       attachments=[back_to_main_menu_kb()])
+            return
+
+        user_data = await context.get_data()
+        category = await category_index.normalise(session, user_data.get("wallet_id"), category)
+        await context.update_data(category=category)
+        await context.set_state(RecurringForm.entering_destination)
+
+        await event.message.answer(
+            f"Категория: «{category}».\n"
+            "Теперь введите назначение траты (например, 'Аренда квартиры', 'Музыкальная подписка'):",
+            attachments=[back_to_main_menu_kb()]
+        )
+
+    @dp.message_callback(F.callback.payload.func(lambda p: "category" in json.loads(p)),
+                         RecurringForm.entering_category)
+    async def recurring_category_chosen(event: MessageCallback, context: MemoryContext):
+        category = json.loads(event.callback.payload)["category"]
+        await context.update_data(category=category)
+        await context.set_state(RecurringForm.entering_destination)
+
+        await event.message.edit(
+            f"Категория: «{category}».\n"
+            "Теперь введите назначение траты (например, 'Аренда квартиры', 'Музыкальная подписка'):",
+            attachments=[back_to_main_menu_kb()]
+        )
+
+    @dp.message_created(RecurringForm.entering_destination)
+    async def recurring_destination_provided(event: MessageCreated, context: MemoryContext):
+        destination = event.message.body.text
+        if not destination or len(destination) > 255:
+            await event.message.answer("Название назначения некорректно. Попробуйте снова.",
+                                       attachments=[back_to_main_menu_kb()])
+            return
+
+        await context.update_data(destination=destination)
+        await context.set_state(RecurringForm.entering_amount)
+        await event.message.answer("Принято. Теперь введите сумму траты (только число):",
+                                   attachments=[back_to_main_menu_kb()])
+
+    @dp.message_created(RecurringForm.entering_amount)
+    async def recurring_amount_provided(event: MessageCreated, context: MemoryContext):
+        try:
+            amount = Decimal(event.message.body.text)
+            if amount <= 0: raise ValueError
+        except (InvalidOperation, ValueError):
+            await event.message.answer("Сумма должна быть положительным числом. Попробуйте снова.",
+                                       attachments=[back_to_main_menu_kb()])
+            return
+
+        await context.update_data(amount=amount)
+        await context.set_state(RecurringForm.entering_day)
+        await event.message.answer(
+            "В какой день месяца записывать трату? Введите число от 1 до 31 "
+            "(в коротких месяцах трата запишется в последний день):",
+            attachments=[back_to_main_menu_kb()]
+        )
+
+    @dp.message_created(RecurringForm.entering_day)
+    async def recurring_day_provided(event: MessageCreated, context: MemoryContext):
+        try:
+            day_of_month = int(event.message.body.text)
+            if not 1 <= day_of_month <= 31: raise ValueError
+        except (TypeError, ValueError):
+            await event.message.answer("День должен быть числом от 1 до 31. Попробуйте снова.",
+                                       attachments=[back_to_main_menu_kb()])
+            return
+
+        user_data = await context.get_data()
+        await context.update_data(day_of_month=day_of_month)
+        await context.set_state(RecurringForm.choosing_share_type)
+        await event.message.answer(
+            "Последний шаг. Эта трата общая для всех участников счёта?",
+            attachments=[is_shared_expense_kb(user_data.get("wallet_id"))]
+        )
+
+    @dp.message_callback(RecurringForm.choosing_share_type)
+    async def recurring_share_type_chosen(event: MessageCallback, context: MemoryContext, session: AsyncSession):
+        payload = json.loads(event.callback.payload)
+        is_shared = payload.get("shared", False)
+
+        user_data = await context.get_data()
+        wallet_id = user_data.get("wallet_id")
+        if not await get_wallet(session, wallet_id):
+            await event.message.edit("❌ Произошла ошибка, счёт не найден.")
+            await show_main_menu(message=None, user_id=event.from_user.user_id, context=context, bot=event.bot)
+            return
+
+        day_of_month = user_data.get("day_of_month")
+        template = RecurringExpense(
+            wallet_id=wallet_id,
+            user_id=event.from_user.user_id,
+            category=user_data.get("category"),
+            destination=user_data.get("destination"),
+            amount=Decimal(user_data.get("amount")),
+            is_shared=is_shared,
+            day_of_month=day_of_month,
+            next_run_at=first_run_at(day_of_month, datetime.now(timezone.utc).replace(tzinfo=None))
+        )
+        session.add(template)
+        await session.commit()
+
+        shared_text = "общая" if is_shared else "личная"
+        await event.message.edit(
+            f"✅ Регулярная трата добавлена!\n\n"
+            f"Категория: {template.category}\n"
+            f"Назначение: {template.destination}\n"
+            f"Сумма: {template.amount} ₽ ({shared_text})\n"
+            f"Каждый месяц, {day_of_month} числа. "
+            f"Первая запись: {to_moscow(template.next_run_at).strftime('%d.%m.%Y %H:%M')}"
+        )
         await show_main_menu(message=None, user_id=event.from_user.user_id, context=context, bot=event.bot)
 
     @dp.message_callback(F.callback.payload.func(lambda p: json.loads(p).get("action") == "my_incomes"))
-    async def show_my_incomes(event: MessageCallback, context: MemoryContext):
+    async def show_my_incomes(event: MessageCallback, context: MemoryContext, session: AsyncSession):
         payload = json.loads(event.callback.payload)
         wallet_id = payload['wallet_id']
+        if not await get_wallet(session, wallet_id):
+            await event.message.edit("❌ Счёт не найден.", attachments=[back_to_main_menu_kb()])
+            return
+        page = payload.get('page', 0)
         user_id = event.from_user.user_id
 
-        async with async_session_maker() as session:
-            stmt = select(Income).where(
-                Income.wallet_id == wallet_id,
-                Income.user_id == user_id
-            ).order_by(Income.created_at.desc())
+        stmt = select(Income).where(
+            Income.wallet_id == wallet_id,
+            Income.user_id == user_id
+        ).order_by(Income.created_at.desc(), Income.id.desc()).offset(page * LIST_LIMIT).limit(LIST_LIMIT + 1)
 
-            incomes = (await session.execute(stmt)).scalars().all()
+        incomes = list((await session.execute(stmt)).scalars().all())
 
-        if not incomes:
+        if not incomes and page == 0:
             await event.message.edit(
                 "У вас пока нет пополнений в этом счёте.",
                 attachments=[wallet_menu_kb(wallet_id, False)]
             )
             return
 
-        total = sum(i.amount for i in incomes)
+        has_more = len(incomes) > LIST_LIMIT
+        incomes = incomes[:LIST_LIMIT]
         text = f"💵 **Ваши пополнения в счёт #{wallet_id}**\n\n"
-        text += f"Всего пополнений: {len(incomes)}\n"
-        text += f"Общая сумма: {total} ₽\n\n"
-        text += "Нажмите на кнопку, чтобы удалить пополнение:"
+        # Итог берётся из снимка журнала с хвостом («Мой итог»), а не суммой по всем секциям.
+        position = await net_positions.wallet(session, user_id, wallet_id)
+        if position:
+            text += f"Всего вами внесено: {position.paid} ₽\n\n"
+        if page > 0 or has_more:
+            text += f"Страница {page + 1}.\n\n"
+        text += "Нажмите на кнопку, чтобы удалить пополнение:" if incomes else "Больше пополнений нет."
 
-        await event.message.edit(text, attachments=[incomes_list_kb(incomes, wallet_id)])
+        await event.message.edit(text, attachments=[incomes_list_kb(incomes, wallet_id, page, has_more)])
 
     @dp.message_callback(F.callback.payload.func(lambda p: json.loads(p).get("action") == "delete_income"))
-    async def delete_income_confirm(event: MessageCallback, context: MemoryContext):
+    async def delete_income_confirm(event: MessageCallback, context: MemoryContext, session: AsyncSession):
         payload = json.loads(event.callback.payload)
         income_id = payload['income_id']
         wallet_id = payload['wallet_id']
 
-        async with async_session_maker() as session:
-            income = await session.get(Income, income_id)
-            if not income:
-                await event.message.edit("❌ Пополнение не найдено.")
-                return
+        if not await get_wallet(session, wallet_id):
+            await event.message.edit("❌ Счёт не найден.", attachments=[back_to_main_menu_kb()])
+            return
+        income = await session.get(Income, income_id)
+        if not income:
+            await event.message.edit("❌ Пополнение не найдено.")
+            return
 
-            utc_time = income.created_at.replace(tzinfo=pytz.utc)
-            moscow_time = utc_time.astimezone(MOSCOW_TZ)
-            date_str = moscow_time.strftime("%d.%m.%Y %H:%M")
-            text = f"Вы уверены, что хотите удалить пополнение?\n\n"
-            text += f"Сумма: {income.amount} ₽\n"
-            text += f"Дата: {date_str}\n"
-            text += f"Описание: {income.description or 'Не указано'}"
+        date_str = to_moscow(income.created_at).strftime("%d.%m.%Y %H:%M")
+        text = f"Вы уверены, что хотите удалить пополнение?\n\n"
+        text += f"Сумма: {income.amount} ₽\n"
+        text += f"Дата: {date_str}\n"
+        text += f"Описание: {income.description or 'Не указано'}"
 
         await event.message.edit(text,
                                  attachments=[confirm_delete_transaction_kb("income", income_id, wallet_id)])
 
     @dp.message_callback(F.callback.payload.func(lambda p: json.loads(p).get("action") == "confirm_delete_income"))
-    async def delete_income_execute(event: MessageCallback, context: MemoryContext):
+    async def delete_income_execute(event: MessageCallback, context: MemoryContext, session: AsyncSession):
         payload = json.loads(event.callback.payload)
         income_id = payload['id']
         wallet_id = payload['wallet_id']
         user_id = event.from_user.user_id
 
-        async with async_session_maker() as session:
-            income = await session.get(Income, income_id)
+        income = await session.get(Income, income_id)
 
-            if not income:
-                await event.message.edit("❌ Пополнение не найдено.")
-                return
+        if not income:
+            await event.message.edit("❌ Пополнение не найдено.")
+            return
 
-            if income.user_id != user_id:
-                await event.message.edit("❌ Вы можете удалять только свои пополнения.")
-                return
+        if income.user_id != user_id:
+            await event.message.edit("❌ Вы можете удалять только свои пополнения.")
+            return
 
-            wallet = await session.get(Wallet, wallet_id)
-            wallet.balance -= income.amount
+        wallet = await get_wallet(session, wallet_id)
+        if not wallet:
+            await event.message.edit("❌ Счёт не найден.", attachments=[back_to_main_menu_kb()])
+            return
+        wallet.balance -= income.amount
 
-            amount = income.amount
-            await session.delete(income)
-            await session.commit()
+        amount = income.amount
+        await apply_income(session, income, sign=-1)
+        await retract_from_checkpoint(session, income)
+        await session.delete(income)
+        await session.commit()
+        net_positions.invalidate_wallet(wallet_id)
 
-            await event.message.edit(
-                f"✅ Пополнение на сумму {amount} ₽ удалено.\n"
-                f"Баланс счёта уменьшен на {amount} ₽."
-            )
+        await event.message.edit(
+            f"✅ Пополнение на сумму {amount} ₽ удалено.\n"
+            f"Баланс счёта уменьшен на {amount} ₽."
+        )
 
-        await show_my_incomes(event, context)
+        await show_my_incomes(event, context, session)
 
     @dp.message_callback(F.callback.payload.func(lambda p: json.loads(p).get("action") == "my_expenses"))
-    async def show_my_expenses(event: MessageCallback, context: MemoryContext):
+    async def show_my_expenses(event: MessageCallback, context: MemoryContext, session: AsyncSession):
         payload = json.loads(event.callback.payload)
         wallet_id = payload['wallet_id']
+        if not await get_wallet(session, wallet_id):
+            await event.message.edit("❌ Счёт не найден.", attachments=[back_to_main_menu_kb()])
+            return
+        page = payload.get('page', 0)
         user_id = event.from_user.user_id
 
-        async with async_session_maker() as session:
-            stmt = select(Expense).where(
-                Expense.wallet_id == wallet_id,
-                Expense.user_id == user_id
-            ).order_by(Expense.created_at.desc())
+        stmt = select(Expense).where(
+            Expense.wallet_id == wallet_id,
+            Expense.user_id == user_id
+        ).order_by(Expense.created_at.desc(), Expense.id.desc()).offset(page * LIST_LIMIT).limit(LIST_LIMIT + 1)
 
-            expenses = (await session.execute(stmt)).scalars().all()
+        expenses = list((await session.execute(stmt)).scalars().all())
 
-        if not expenses:
+        if not expenses and page == 0:
             await event.message.edit(
                 "У вас пока нет трат в этом счёте.",
                 attachments=[wallet_menu_kb(wallet_id, False)]
             )
             return
 
-        total = sum(e.amount for e in expenses)
+        has_more = len(expenses) > LIST_LIMIT
+        expenses = expenses[:LIST_LIMIT]
         text = f"🧾 **Ваши траты в счёте #{wallet_id}**\n\n"
-        text += f"Всего трат: {len(expenses)}\n"
-        text += f"Общая сумма: {total} ₽\n\n"
-        text += "Нажмите на кнопку, чтобы удалить трату:"
+        position = await net_positions.wallet(session, user_id, wallet_id)
+        if position:
+            text += f"Личные траты всего: {position.personal_spent} ₽\n"
+            text += f"Ваша доля общих трат: {position.shared_share:.2f} ₽\n\n"
+        if page > 0 or has_more:
+            text += f"Страница {page + 1}.\n\n"
+        text += "Нажмите на кнопку, чтобы удалить трату:" if expenses else "Больше трат нет."
 
-        await event.message.edit(text, attachments=[expenses_list_kb(expenses, wallet_id)])
+        await event.message.edit(text, attachments=[expenses_list_kb(expenses, wallet_id, page, has_more)])
 
     @dp.message_callback(F.callback.payload.func(lambda p: json.loads(p).get("action") == "download_full_stats"))
     async def download_full_stats(event: MessageCallback, context: MemoryContext):
+        # ReportLab тяжёлый, поэтому модуль грузится при первом отчёте (или фоновой предзагрузкой).
+        from utils.pdf_stats import generate_pdf
+
         payload = json.loads(event.callback.payload)
         wallet_id = payload['wallet_id']
-        async with async_session_maker() as session:
-            wallet = await session.get(Wallet, wallet_id)
+
+        async def load(session: AsyncSession):
             incomes = (await session.execute(select(Income).where(Income.wallet_id == wallet_id))).scalars().all()
             expenses = (await session.execute(select(Expense).where(Expense.wallet_id == wallet_id))).scalars().all()
             wallet = (await session.execute(
-                select(Wallet).where(Wallet.id == wallet_id).options(
+                select(Wallet).where(Wallet.id == wallet_id, Wallet.deleted_at.is_(None)).options(
                     selectinload(Wallet.members).selectinload(WalletMember.user))
             )).scalar_one_or_none()
-            members = wallet.members
+            positions = await load_positions(session, wallet_id)
+            # Итоги шапки — из дневных агрегатов: строки архивных секций в incomes/expenses не попадают.
+            totals = await income_total(session, wallet_id), await expense_total(session, wallet_id)
+            return incomes, expenses, wallet, positions, totals
+
+        incomes, expenses, wallet, positions, (total_income, total_expense) = await read_query(load)
+        if not wallet:
+            await event.message.edit("❌ Счёт не найден.", attachments=[back_to_main_menu_kb()])
+            return
+        members = wallet.members
+        balance = settle_balances([m.user_id for m in members], positions.paid, positions.personal_spent,
+                                  positions.shared_total)
 
         with tempfile.NamedTemporaryFile(suffix=".pdf", delete=False) as tmp:
-            generate_pdf(wallet, incomes, expenses, members, tmp.name)
+            generate_pdf(wallet, incomes, expenses, members, tmp.name, balance=balance,
+                         income_total=total_income, expense_total=total_expense)
             filename = tmp.name
         await event.bot.send_message(
             user_id=event.from_user.user_id,
@@ -527,62 +1046,72 @@ async def register_handlers(dp: Dispatcher):
         os.remove(filename)
 
     @dp.message_callback(F.callback.payload.func(lambda p: json.loads(p).get("action") == "delete_expense"))
-    async def delete_expense_confirm(event: MessageCallback, context: MemoryContext):
+    async def delete_expense_confirm(event: MessageCallback, context: MemoryContext, session: AsyncSession):
         payload = json.loads(event.callback.payload)
         expense_id = payload['expense_id']
         wallet_id = payload['wallet_id']
 
-        async with async_session_maker() as session:
-            expense = await session.get(Expense, expense_id)
-            if not expense:
-                await event.message.edit("❌ Трата не найдена.")
-                return
-
-            utc_time = expense.created_at.replace(tzinfo=pytz.utc)
-            moscow_time = utc_time.astimezone(MOSCOW_TZ)
-            date_str = moscow_time.strftime("%d.%m.%Y %H:%M")
-            shared_text = "Общая" if expense.is_shared else "Личная"
-            text = f"Вы уверены, что хотите удалить трату?\n\n"
-            text += f"Категория: {expense.category}\n"
-            text += f"Назначение: {expense.destination}\n"
-            text += f"Сумма: {expense.amount} ₽\n"
-            text += f"Тип: {shared_text}\n"
-            text += f"Дата: {date_str}"
+        if not await get_wallet(session, wallet_id):
+            await event.message.edit("❌ Счёт не найден.", attachments=[back_to_main_menu_kb()])
+            return
+        expense = await session.get(Expense, expense_id)
+        if not expense:
+            await event.message.edit("❌ Трата не найдена.")
+            return
+
+        date_str = to_moscow(expense.created_at).strftime("%d.%m.%Y %H:%M")
+        shared_text = "Общая" if expense.is_shared else "Личная"
+        text = f"Вы уверены, что хотите удалить трату?\n\n"
+        text += f"Категория: {expense.category}\n"
+        text += f"Назначение: {expense.destination}\n"
+        text += f"Сумма: {expense.amount} ₽\n"
+        text += f"Тип: {shared_text}\n"
+        text += f"Дата: {date_str}"
 
         await event.message.edit(text,
                                  attachments=[confirm_delete_transaction_kb("expense", expense_id, wallet_id)])
 
     @dp.message_callback(F.callback.payload.func(lambda p: json.loads(p).get("action") == "confirm_delete_expense"))
-    async def delete_expense_execute(event: MessageCallback, context: MemoryContext):
+    async def delete_expense_execute(event: MessageCallback, context: MemoryContext, session: AsyncSession):
         payload = json.loads(event.callback.payload)
         expense_id = payload['id']
         wallet_id = payload['wallet_id']
         user_id = event.from_user.user_id
 
-        async with async_session_maker() as session:
-            expense = await session.get(Expense, expense_id)
-
-            if not expense:
-                await event.message.edit("❌ Трата не найдена.")
-                return
+        expense = await session.get(Expense, expense_id)
 
-            if expense.user_id != user_id:
-                await event.message.edit("❌ Вы можете удалять только свои траты.")
-                return
+        if not expense:
+            await event.message.edit("❌ Трата не найдена.")
+            return
 
-            wallet = await session.get(Wallet, wallet_id)
-            wallet.balance += expense.amount
+        if expense.user_id != user_id:
+            await event.message.edit("❌ Вы можете удалять только свои траты.")
+            return
 
-            amount = expense.amount
-            await session.delete(expense)
-            await session.commit()
+        wallet = await get_wallet(session, wallet_id)
+        if not wallet:
+            await event.message.edit("❌ Счёт не найден.", attachments=[back_to_main_menu_kb()])
+            return
+        wallet.balance += expense.amount
+
+        amount = expense.amount
+        await apply_expense(session, expense, sign=-1)
+        await category_index.record(session, expense.wallet_id, expense.category, sign=-1)
+        await retract_from_checkpoint(session, expense)
+        await session.delete(expense)
+        await session.commit()
+        net_positions.invalidate_wallet(wallet_id)
+        if expense.is_shared:
+            author = event.from_user.first_name or str(user_id)
+            wallet_notifier.notify(wallet_id, wallet.name, user_id,
+                                   f"➖ удалена {amount} ₽ · {expense.category} — {expense.destination} ({author})")
 
-            await event.message.edit(
-                f"✅ Трата на сумму {amount} ₽ удалена.\n"
-                f"Баланс счёта восстановлен на {amount} ₽."
-            )
+        await event.message.edit(
+            f"✅ Трата на сумму {amount} ₽ удалена.\n"
+            f"Баланс счёта восстановлен на {amount} ₽."
+        )
 
-        await show_my_expenses(event, context)
+        await show_my_expenses(event, context, session)
 
     @dp.message_created(F.message.body.text)
     async def unknown_message_handler(event: MessageCreated, context: MemoryContext):
@@ -595,3 +1124,12 @@ async def register_handlers(dp: Dispatcher):
         if current_state is None:
             await event.message.answer("🤔 Я не понял вашу команду")
             await show_main_menu(message=None, context=context, bot=event.bot, user_id=event.from_user.user_id)
+
+    @dp.message_callback()
+    async def stale_callback_handler(event: MessageCallback, context: MemoryContext):
+        """
+        Срабатывает на кнопку, которую не принял ни один хендлер: обычно это кнопка мастера,
+        состояние которого уже удалено по истечении срока или после перезапуска.
+        """
+        await event.answer(notification="⌛ Сессия истекла, начните заново.")
+        await show_main_menu(message=event.message, context=context)
@@ -1,18 +1,32 @@
 import json
+from functools import lru_cache
 
 from maxapi.utils.inline_keyboard import InlineKeyboardBuilder
 from maxapi.types.attachments.buttons.callback_button import CallbackButton
 
+# Клавиатуры без параметров собираются один раз при импорте, а клавиатуры с небольшими
+# ключами (ID счёта, флаги) кэшируются в LRU. Один и тот же объект разметки отдаётся
+# во все хендлеры: maxapi только сериализует вложения, поэтому изменять их нельзя.
+KEYBOARD_CACHE_SIZE = 1024
 
-def main_menu_kb():
-    """Главное меню."""
+
+def _build_main_menu_kb():
     builder = InlineKeyboardBuilder()
     builder.row(CallbackButton(text="Создать новый счёт", payload=json.dumps({"menu": "new_wallet"})))
     builder.row(CallbackButton(text="Мои счета", payload=json.dumps({"menu": "my_wallets"})))
+    builder.row(CallbackButton(text="📊 Мой итог", payload=json.dumps({"menu": "my_total"})))
     builder.row(CallbackButton(text="Присоединиться к счёту", payload=json.dumps({"menu": "connect_wallet"})))
     return builder.as_markup()
 
 
+_MAIN_MENU_KB = _build_main_menu_kb()
+
+
+def main_menu_kb():
+    """Главное меню."""
+    return _MAIN_MENU_KB
+
+
 def wallets_list_kb(wallets: list):
     """Список счетов пользователя."""
     builder = InlineKeyboardBuilder()
@@ -24,6 +38,7 @@ def wallets_list_kb(wallets: list):
     return builder.as_markup()
 
 
+@lru_cache(maxsize=KEYBOARD_CACHE_SIZE)
 def wallet_menu_kb(wallet_id: int, is_owner: bool):
     """Меню для конкретного счёта."""
     builder = InlineKeyboardBuilder()
@@ -36,11 +51,17 @@ def wallet_menu_kb(wallet_id: int, is_owner: bool):
         CallbackButton(text="💰 Пополнить", payload=json.dumps({"action": "add_capital", "wallet_id": wallet_id}))
     )
     builder.row(
-        CallbackButton(text="💸 Добавить трату", payload=json.dumps({"action": "add_expense", "wallet_id": wallet_id})))
+        CallbackButton(text="💸 Добавить трату", payload=json.dumps({"action": "add_expense", "wallet_id": wallet_id})),
+        CallbackButton(text="🔁 Регулярные траты", payload=json.dumps({"action": "recurring", "wallet_id": wallet_id}))
+    )
     builder.row(
         CallbackButton(text="💵 Мои пополнения", payload=json.dumps({"action": "my_incomes", "wallet_id": wallet_id})),
         CallbackButton(text="🧾 Мои траты", payload=json.dumps({"action": "my_expenses", "wallet_id": wallet_id}))
     )
+    builder.row(
+        CallbackButton(text="🔍 Поиск трат", payload=json.dumps({"action": "search_expenses", "wallet_id": wallet_id})),
+        CallbackButton(text="📥 Импорт CSV", payload=json.dumps({"action": "import_csv", "wallet_id": wallet_id}))
+    )
     if is_owner:
         builder.row(CallbackButton(text="🗑 Удалить счёт",
                                    payload=json.dumps({"action": "delete_wallet", "wallet_id": wallet_id})))
@@ -49,6 +70,44 @@ def wallet_menu_kb(wallet_id: int, is_owner: bool):
     return builder.as_markup()
 
 
+@lru_cache(maxsize=KEYBOARD_CACHE_SIZE)
+def stats_period_kb(wallet_id: int):
+    """Выбор периода статистики."""
+    builder = InlineKeyboardBuilder()
+    builder.row(
+        CallbackButton(text="За неделю",
+                       payload=json.dumps({"action": "stats_period", "period": "week", "wallet_id": wallet_id})),
+        CallbackButton(text="За месяц",
+                       payload=json.dumps({"action": "stats_period", "period": "month", "wallet_id": wallet_id}))
+    )
+    builder.row(
+        CallbackButton(text="📅 Свой период", payload=json.dumps({"action": "stats_custom", "wallet_id": wallet_id})))
+    builder.row(
+        CallbackButton(text="‹ Назад к счёту", payload=json.dumps({"action": "open_wallet", "wallet_id": wallet_id})))
+    return builder.as_markup()
+
+
+@lru_cache(maxsize=KEYBOARD_CACHE_SIZE)
+def search_results_kb(wallet_id: int, page: int, has_more: bool):
+    """Листание результатов поиска трат."""
+    builder = InlineKeyboardBuilder()
+    nav = []
+    if page > 0:
+        nav.append(CallbackButton(text="‹ Новее",
+                                  payload=json.dumps({"action": "search_page", "wallet_id": wallet_id, "page": page - 1})))
+    if has_more:
+        nav.append(CallbackButton(text="Старее ›",
+                                  payload=json.dumps({"action": "search_page", "wallet_id": wallet_id, "page": page + 1})))
+    if nav:
+        builder.row(*nav)
+    builder.row(
+        CallbackButton(text="🔍 Новый поиск", payload=json.dumps({"action": "search_expenses", "wallet_id": wallet_id})))
+    builder.row(
+        CallbackButton(text="‹ Назад к счёту", payload=json.dumps({"action": "open_wallet", "wallet_id": wallet_id})))
+    return builder.as_markup()
+
+
+@lru_cache(maxsize=KEYBOARD_CACHE_SIZE)
 def confirm_delete_kb(wallet_id: int):
     """Подтверждение удаления."""
     builder = InlineKeyboardBuilder()
@@ -59,13 +118,21 @@ def confirm_delete_kb(wallet_id: int):
     return builder.as_markup()
 
 
-def back_to_main_menu_kb():
-    """Кнопка "Назад" в главное меню."""
+def _build_back_to_main_menu_kb():
     builder = InlineKeyboardBuilder()
     builder.row(CallbackButton(text="‹ Главное меню", payload=json.dumps({"menu": "back_to_main"})))
     return builder.as_markup()
 
 
+_BACK_TO_MAIN_MENU_KB = _build_back_to_main_menu_kb()
+
+
+def back_to_main_menu_kb():
+    """Кнопка "Назад" в главное меню."""
+    return _BACK_TO_MAIN_MENU_KB
+
+
+@lru_cache(maxsize=KEYBOARD_CACHE_SIZE)
 def is_shared_expense_kb(wallet_id: int):
     """Выбор: общая трата или личная."""
     builder = InlineKeyboardBuilder()
@@ -76,8 +143,21 @@ def is_shared_expense_kb(wallet_id: int):
     return builder.as_markup()
 
 
-def incomes_list_kb(incomes: list, wallet_id: int):
-    """Список пополнений пользователя с возможностью удалить."""
+@lru_cache(maxsize=KEYBOARD_CACHE_SIZE)
+def expense_categories_kb(categories: tuple[str, ...]):
+    """Частые категории счёта, по две в ряд."""
+    builder = InlineKeyboardBuilder()
+    for i in range(0, len(categories), 2):
+        builder.row(*(
+            CallbackButton(text=category, payload=json.dumps({"category": category}))
+            for category in categories[i:i + 2]
+        ))
+    builder.row(CallbackButton(text="‹ Главное меню", payload=json.dumps({"menu": "back_to_main"})))
+    return builder.as_markup()
+
+
+def incomes_list_kb(incomes: list, wallet_id: int, page: int = 0, has_more: bool = False):
+    """Страница пополнений пользователя с возможностью удалить и листанием."""
     builder = InlineKeyboardBuilder()
     for income in incomes:
         date_str = income.created_at.strftime("%d.%m.%Y %H:%M")
@@ -85,12 +165,21 @@ def incomes_list_kb(incomes: list, wallet_id: int):
         payload = json.dumps({"action": "delete_income", "income_id": income.id, "wallet_id": wallet_id})
         builder.row(CallbackButton(text=btn_text, payload=payload))
 
+    nav = []
+    if page > 0:
+        nav.append(CallbackButton(text="‹ Новее",
+                                  payload=json.dumps({"action": "my_incomes", "wallet_id": wallet_id, "page": page - 1})))
+    if has_more:
+        nav.append(CallbackButton(text="Старее ›",
+                                  payload=json.dumps({"action": "my_incomes", "wallet_id": wallet_id, "page": page + 1})))
+    if nav:
+        builder.row(*nav)
     builder.row(CallbackButton(text="‹ Назад", payload=json.dumps({"action": "open_wallet", "wallet_id": wallet_id})))
     return builder.as_markup()
 
 
-def expenses_list_kb(expenses: list, wallet_id: int):
-    """Список трат пользователя с возможностью удаления."""
+def expenses_list_kb(expenses: list, wallet_id: int, page: int = 0, has_more: bool = False):
+    """Страница трат пользователя с возможностью удаления и листанием."""
     builder = InlineKeyboardBuilder()
     for expense in expenses:
         date_str = expense.created_at.strftime("%d.%m.%Y %H:%M")
@@ -99,6 +188,29 @@ def expenses_list_kb(expenses: list, wallet_id: int):
         payload = json.dumps({"action": "delete_expense", "expense_id": expense.id, "wallet_id": wallet_id})
         builder.row(CallbackButton(text=btn_text, payload=payload))
 
+    nav = []
+    if page > 0:
+        nav.append(CallbackButton(text="‹ Новее",
+                                  payload=json.dumps({"action": "my_expenses", "wallet_id": wallet_id, "page": page - 1})))
+    if has_more:
+        nav.append(CallbackButton(text="Старее ›",
+                                  payload=json.dumps({"action": "my_expenses", "wallet_id": wallet_id, "page": page + 1})))
+    if nav:
+        builder.row(*nav)
+    builder.row(CallbackButton(text="‹ Назад", payload=json.dumps({"action": "open_wallet", "wallet_id": wallet_id})))
+    return builder.as_markup()
+
+
+def recurring_list_kb(templates: list, wallet_id: int):
+    """Регулярные траты пользователя в счёте с возможностью удалить и кнопкой добавления."""
+    builder = InlineKeyboardBuilder()
+    for template in templates:
+        shared_marker = "👥" if template.is_shared else "👤"
+        btn_text = f"🗑 {template.amount} ₽ | {template.category} | {shared_marker} | {template.day_of_month} числа"
+        payload = json.dumps({"action": "delete_recurring", "id": template.id, "wallet_id": wallet_id})
+        builder.row(CallbackButton(text=btn_text, payload=payload))
+
+    builder.row(CallbackButton(text="➕ Добавить", payload=json.dumps({"action": "add_recurring", "wallet_id": wallet_id})))
     builder.row(CallbackButton(text="‹ Назад", payload=json.dumps({"action": "open_wallet", "wallet_id": wallet_id})))
     return builder.as_markup()
 
@@ -1,28 +1,62 @@
 import asyncio
 import logging
-from maxapi import Bot, Dispatcher
+from maxapi import Bot
 from maxapi.enums.parse_mode import ParseMode
 from maxapi.types import BotCommand
 
 from config import settings
-from database.db import init_db
+from database.db import init_db, async_session_maker
+from database.ledger import CheckpointWriter
+from database.partitions import PartitionMaintainer
+from database.recurring import RecurringScheduler
+from database.users import user_registry
+from database.wallets import WalletPurger
 from handlers.handlers import register_handlers
+from middlewares.db import DbSessionMiddleware
+from middlewares.users import RegisterUserMiddleware
+from states.storage import BoundedDispatcher, fsm_storage
+from utils.notifications import wallet_notifier
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
 
+def preload_heavy_modules():
+    """Загружает ReportLab и шрифты отчётов заранее, чтобы первый PDF не ждал импорта."""
+    from utils.pdf_stats import register_fonts
+    register_fonts()
+
+
+async def build_dispatcher() -> tuple[BoundedDispatcher, DbSessionMiddleware]:
+    dp = BoundedDispatcher(fsm_storage)
+    dp.outer_middleware(RegisterUserMiddleware(user_registry))
+    db_middleware = DbSessionMiddleware(async_session_maker)
+    dp.middleware(db_middleware)
+    await register_handlers(dp)
+    return dp, db_middleware
+
+
 async def main():
     await init_db()
 
     bot = Bot(settings.bot_token, parse_mode=ParseMode.MARKDOWN)
-    dp = Dispatcher()
+    dp, db_middleware = await build_dispatcher()
+    background_tasks = []
 
-    await register_handlers(dp)
+    @dp.on_started()
+    async def on_started():
+        if settings.preload_modules:
+            background_tasks.append(asyncio.create_task(asyncio.to_thread(preload_heavy_modules)))
 
     logger.info("Бот запущен!")
     await bot.set_my_commands(BotCommand(name="start", description="Начать"))
     await bot.delete_webhook()
+    background_tasks.append(asyncio.create_task(CheckpointWriter(async_session_maker, db_middleware.idle_for).run()))
+    background_tasks.append(asyncio.create_task(PartitionMaintainer(async_session_maker).run()))
+    background_tasks.append(asyncio.create_task(fsm_storage.run(settings.fsm_sweep_interval)))
+    background_tasks.append(asyncio.create_task(WalletPurger(async_session_maker).run()))
+    background_tasks.append(asyncio.create_task(wallet_notifier.run(bot)))
+    background_tasks.append(asyncio.create_task(RecurringScheduler(async_session_maker, wallet_notifier).run()))
     await dp.start_polling(bot)
 
 
@@ -0,0 +1,38 @@
+import time
+from typing import Any, Awaitable, Callable
+
+from maxapi.filters.middleware import BaseMiddleware
+from sqlalchemy.ext.asyncio import async_sessionmaker
+
+
+class DbSessionMiddleware(BaseMiddleware):
+    """
+    Единица работы на обновление.
+
+    Хендлер получает одну сессию (аргумент `session`). Идентификаторы новых строк
+    получаются через flush(). Хендлер, меняющий данные, сам вызывает session.commit() до
+    ответа пользователю: так «✅» не показывается при неудачной фиксации, а блокировки строк
+    (счёт, снимок журнала) не держатся, пока идут запросы к API Max. Остаток (чтения после
+    фиксации) middleware фиксирует после хендлера, при исключении транзакция откатывается.
+    """
+
+    def __init__(self, session_maker: async_sessionmaker):
+        self.session_maker = session_maker
+        self.last_update_at = time.monotonic()
+
+    def idle_for(self) -> float:
+        """Сколько секунд не было обновлений; используется фоновыми задачами."""
+        return time.monotonic() - self.last_update_at
+
+    async def __call__(
+        self,
+        handler: Callable[[Any, dict[str, Any]], Awaitable[Any]],
+        event_object: Any,
+        data: dict[str, Any]
+    ) -> Any:
+        self.last_update_at = time.monotonic()
+        async with self.session_maker() as session:
+            data["session"] = session
+            result = await handler(event_object, data)
+            await session.commit()
+            return result
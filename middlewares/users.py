@@ -0,0 +1,24 @@
+from typing import Any, Awaitable, Callable
+
+from maxapi.filters.middleware import BaseMiddleware
+from maxapi.types.users import User as MaxUser
+
+from database.users import UserRegistry
+
+
+class RegisterUserMiddleware(BaseMiddleware):
+    """Регистрирует отправителя каждого обновления до вызова хендлера."""
+
+    def __init__(self, registry: UserRegistry):
+        self.registry = registry
+
+    async def __call__(
+        self,
+        handler: Callable[[Any, dict[str, Any]], Awaitable[Any]],
+        event_object: Any,
+        data: dict[str, Any]
+    ) -> Any:
+        user = getattr(event_object, "from_user", None)
+        if isinstance(user, MaxUser) and not user.is_bot:
+            await self.registry.register(user.user_id, user.username, user.first_name)
+        return await handler(event_object, data)
@@ -12,3 +12,23 @@ class TransactionForm(StatesGroup):
     entering_expense_destination = State()
     entering_expense_amount = State()
     choosing_expense_share_type = State()
+
+
+class StatsForm(StatesGroup):
+    entering_range = State()
+
+
+class SearchForm(StatesGroup):
+    entering_query = State()
+
+
+class ImportForm(StatesGroup):
+    waiting_file = State()
+
+
+class RecurringForm(StatesGroup):
+    entering_category = State()
+    entering_destination = State()
+    entering_amount = State()
+    entering_day = State()
+    choosing_share_type = State()
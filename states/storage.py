@@ -0,0 +1,104 @@
+import asyncio
+import logging
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+
+from maxapi import Dispatcher
+from maxapi.context import MemoryContext
+
+from config import settings
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class FsmMetrics:
+    live: int = 0
+    expired: int = 0
+    evicted: int = 0
+    abandoned: int = 0
+
+
+class BoundedContextStorage:
+    """
+    Хранилище MemoryContext с ограничением по времени и размеру.
+
+    Контекст, к которому не обращались дольше `ttl` секунд, удаляется вместе с состоянием
+    и данными мастера. Если контекстов больше `max_entries`, вытесняются давно не
+    использованные (LRU). Счётчики: expired — удалены по TTL, evicted — вытеснены по
+    размеру, abandoned — из них с незавершённым мастером.
+    """
+
+    def __init__(self, ttl: float, max_entries: int):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries: OrderedDict[tuple[int, int], tuple[MemoryContext, float]] = OrderedDict()
+        self._metrics = FsmMetrics()
+
+    def get(self, chat_id: int, user_id: int) -> MemoryContext:
+        key = (chat_id, user_id)
+        now = time.monotonic()
+        entry = self._entries.pop(key, None)
+        if entry is not None and now - entry[1] > self.ttl:
+            self._drop(entry[0], expired=True)
+            entry = None
+
+        context = entry[0] if entry is not None else MemoryContext(chat_id, user_id)
+        self._entries[key] = (context, now)
+        while len(self._entries) > self.max_entries:
+            _, (oldest, _) = self._entries.popitem(last=False)
+            self._drop(oldest, expired=False)
+        return context
+
+    def sweep(self) -> int:
+        """Удаляет контексты старше TTL. Записи упорядочены по последнему обращению."""
+        deadline = time.monotonic() - self.ttl
+        removed = 0
+        while self._entries:
+            key, (context, last_used) = next(iter(self._entries.items()))
+            if last_used > deadline:
+                break
+            del self._entries[key]
+            self._drop(context, expired=True)
+            removed += 1
+        return removed
+
+    def _drop(self, context: MemoryContext, expired: bool):
+        if expired:
+            self._metrics.expired += 1
+        else:
+            self._metrics.evicted += 1
+        # Чтение без блокировки: контекст уже недоступен новым обновлениям.
+        if context._state is not None or context._context:
+            self._metrics.abandoned += 1
+
+    def metrics(self) -> FsmMetrics:
+        return FsmMetrics(
+            live=len(self._entries),
+            expired=self._metrics.expired,
+            evicted=self._metrics.evicted,
+            abandoned=self._metrics.abandoned
+        )
+
+    async def run(self, interval: float):
+        """Фоновая задача: периодически чистит устаревшие контексты и пишет метрики в лог."""
+        while True:
+            await asyncio.sleep(interval)
+            removed = self.sweep()
+            if removed:
+                logger.info("Контексты FSM: удалено %s, %s", removed, self.metrics())
+
+
+class BoundedDispatcher(Dispatcher):
+    """Dispatcher, который хранит контексты FSM в BoundedContextStorage вместо бесконечного списка."""
+
+    def __init__(self, storage: BoundedContextStorage, **kwargs):
+        super().__init__(**kwargs)
+        self.storage = storage
+
+    def _Dispatcher__get_memory_context(self, chat_id: int, user_id: int) -> MemoryContext:
+        return self.storage.get(chat_id, user_id)
+
+
+fsm_storage = BoundedContextStorage(settings.fsm_ttl, settings.fsm_max_entries)
@@ -0,0 +1,202 @@
+import codecs
+import csv
+import io
+import re
+import tempfile
+from dataclasses import dataclass, field
+from datetime import date, datetime, time, timedelta, timezone
+from functools import lru_cache
+from decimal import Decimal, InvalidOperation
+from typing import Iterable, TextIO
+
+import aiohttp
+
+from utils.dates import moscow_tz
+
+MAX_IMPORT_ROWS = 100_000
+MAX_IMPORT_BYTES = 20 * 1024 * 1024
+# Файл до этого размера держится в памяти, больше — во временном файле на диске.
+SPOOL_BYTES = 1024 * 1024
+MAX_AMOUNT = Decimal("9999999999.99")
+DEFAULT_DESTINATION = "Импорт"
+
+# Заголовки столбцов (регистр не важен) и их синонимы.
+COLUMNS = {
+    "date": ("дата", "date"),
+    "type": ("тип", "type"),
+    "amount": ("сумма", "amount"),
+    "category": ("категория", "category"),
+    "destination": ("назначение", "destination"),
+    "description": ("описание", "description", "комментарий"),
+    "shared": ("общая", "shared"),
+}
+REQUIRED_COLUMNS = ("date", "type", "amount")
+EXPENSE_TYPES = {"расход", "трата", "expense"}
+INCOME_TYPES = {"доход", "пополнение", "income"}
+YES = {"да", "yes", "1", "true", "+"}
+# ДД.ММ.ГГГГ или ГГГГ-ММ-ДД, время ЧЧ:ММ необязательно.
+DATE_RE = re.compile(
+    r"(?P<day>\d{1,2})\.(?P<month>\d{1,2})\.(?P<year>\d{4})(?:\s+(?P<hour>\d{1,2}):(?P<minute>\d{2}))?"
+    r"|(?P<iso_year>\d{4})-(?P<iso_month>\d{1,2})-(?P<iso_day>\d{1,2})(?:[ T](?P<iso_hour>\d{1,2}):(?P<iso_minute>\d{2}))?"
+)
+
+# Порядок полей в записях совпадает со столбцами COPY в database.imports.
+EXPENSE_COLUMNS = ("wallet_id", "user_id", "category", "destination", "amount", "is_shared", "description",
+                   "created_at")
+INCOME_COLUMNS = ("wallet_id", "user_id", "amount", "description", "created_at")
+
+
+@dataclass
+class ParsedImport:
+    expenses: list[tuple] = field(default_factory=list)
+    incomes: list[tuple] = field(default_factory=list)
+    errors: list[str] = field(default_factory=list)
+
+
+class CsvImportError(ValueError):
+    pass
+
+
+def parse_amount(value: str) -> Decimal:
+    """Сумма с запятой или точкой, пробелы между разрядами допускаются."""
+    try:
+        amount = Decimal(value.replace("\u00a0", "").replace(" ", "").replace(",", "."))
+    except InvalidOperation:
+        raise CsvImportError(f"некорректная сумма «{value}»")
+    if not 0 < amount <= MAX_AMOUNT:
+        raise CsvImportError(f"сумма должна быть положительной и не больше {MAX_AMOUNT}")
+    return amount.quantize(Decimal("0.01"))
+
+
+@lru_cache(maxsize=4096)
+def _moscow_offset(day: date) -> timedelta:
+    return moscow_tz().utcoffset(datetime.combine(day, time(12)))
+
+
+def parse_moscow_datetime(value: str) -> datetime:
+    """Дата (или дата и время) по Москве → наивное время UTC, как в БД. Дата без времени — полдень."""
+    match = DATE_RE.fullmatch(value.strip())
+    if match is None:
+        raise CsvImportError(f"некорректная дата «{value}», ожидается ДД.ММ.ГГГГ")
+    prefix = "" if match["year"] else "iso_"
+    year, month, day, hour, minute = (match[prefix + part] for part in ("year", "month", "day", "hour", "minute"))
+    try:
+        local = datetime(int(year), int(month), int(day), int(hour) if hour else 12, int(minute) if minute else 0)
+    except ValueError:
+        raise CsvImportError(f"некорректная дата «{value}»")
+    return local - _moscow_offset(local.date())
+
+
+def _header_map(header: list[str]) -> dict[str, int]:
+    positions = {}
+    for index, title in enumerate(header):
+        title = title.strip().lower()
+        for column, aliases in COLUMNS.items():
+            if title in aliases:
+                positions[column] = index
+    missing = [COLUMNS[c][0] for c in REQUIRED_COLUMNS if c not in positions]
+    if missing:
+        raise CsvImportError("нет обязательных столбцов: " + ", ".join(missing))
+    return positions
+
+
+def parse_rows(rows: Iterable[list[str]], wallet_id: int, user_id: int,
+               not_before: datetime | None = None) -> ParsedImport:
+    """
+    Проверяет строки по одной и собирает записи для COPY. Ошибки копятся по номерам
+    строк файла, разбор продолжается, чтобы пользователь увидел их все сразу.
+    """
+    result = ParsedImport()
+    rows = iter(rows)
+    try:
+        positions = _header_map(next(rows))
+    except StopIteration:
+        result.errors.append("файл пуст")
+        return result
+    except CsvImportError as e:
+        result.errors.append(str(e))
+        return result
+
+    now = datetime.now(timezone.utc).replace(tzinfo=None)
+
+    def cell(row: list[str], column: str) -> str:
+        index = positions.get(column)
+        return row[index].strip() if index is not None and index < len(row) else ""
+
+    for line_number, row in enumerate(rows, start=2):
+        if not any(value.strip() for value in row):
+            continue
+        if len(result.expenses) + len(result.incomes) >= MAX_IMPORT_ROWS:
+            result.errors.append(f"в файле больше {MAX_IMPORT_ROWS} строк")
+            break
+        try:
+            created_at = parse_moscow_datetime(cell(row, "date"))
+            if created_at > now:
+                raise CsvImportError("дата в будущем")
+            if not_before is not None and created_at < not_before:
+                raise CsvImportError("дата раньше архивного периода")
+            amount = parse_amount(cell(row, "amount"))
+            description = cell(row, "description") or None
+            row_type = cell(row, "type").lower()
+
+            if row_type in EXPENSE_TYPES:
+                category = " ".join(cell(row, "category").split())
+                destination = cell(row, "destination") or DEFAULT_DESTINATION
+                if not category or len(category) > 100:
+                    raise CsvImportError("категория обязательна и не длиннее 100 символов")
+                if len(destination) > 255:
+                    raise CsvImportError("назначение длиннее 255 символов")
+                is_shared = cell(row, "shared").lower() in YES
+                result.expenses.append(
+                    (wallet_id, user_id, category, destination, amount, is_shared, description, created_at)
+                )
+            elif row_type in INCOME_TYPES:
+                if description is not None and len(description) > 255:
+                    raise CsvImportError("описание пополнения длиннее 255 символов")
+                result.incomes.append((wallet_id, user_id, amount, description or "Импорт", created_at))
+            else:
+                raise CsvImportError(f"неизвестный тип «{cell(row, 'type')}», ожидается «расход» или «доход»")
+        except CsvImportError as e:
+            result.errors.append(f"строка {line_number}: {e}")
+    return result
+
+
+def parse_csv(stream: TextIO, wallet_id: int, user_id: int, not_before: datetime | None = None) -> ParsedImport:
+    """Разбирает CSV с разделителем «;» или «,» (определяется по заголовку)."""
+    header = stream.readline()
+    delimiter = ";" if header.count(";") >= header.count(",") else ","
+    stream.seek(0)
+    return parse_rows(csv.reader(stream, delimiter=delimiter), wallet_id, user_id, not_before)
+
+
+async def download_csv(url: str) -> TextIO:
+    """
+    Скачивает файл потоком, не загружая его целиком в память. Кодировка — UTF-8, а если
+    файл в ней не читается, cp1251 (так сохраняет CSV русский Excel).
+    """
+    buffer = tempfile.SpooledTemporaryFile(max_size=SPOOL_BYTES)
+    utf8 = codecs.getincrementaldecoder("utf-8")()
+    encoding = "utf-8-sig"
+    size = 0
+    try:
+        async with aiohttp.ClientSession() as http:
+            async with http.get(url) as response:
+                response.raise_for_status()
+                async for chunk in response.content.iter_chunked(64 * 1024):
+                    size += len(chunk)
+                    if size > MAX_IMPORT_BYTES:
+                        raise CsvImportError(f"файл больше {MAX_IMPORT_BYTES // (1024 * 1024)} МБ")
+                    buffer.write(chunk)
+                    if encoding != "cp1251":
+                        try:
+                            utf8.decode(chunk)
+                        except UnicodeDecodeError:
+                            encoding = "cp1251"
+    except aiohttp.ClientError as e:
+        buffer.close()
+        raise CsvImportError(f"не удалось скачать файл: {e}")
+    except CsvImportError:
+        buffer.close()
+        raise
+    buffer.seek(0)
+    return io.TextIOWrapper(buffer, encoding=encoding, errors="replace", newline="")
@@ -0,0 +1,41 @@
+from datetime import datetime, date, timedelta, timezone
+from functools import cache
+
+
+@cache
+def moscow_tz():
+    """Часовой пояс Москвы; pytz загружается при первом обращении, а не при старте бота."""
+    import pytz
+    return pytz.timezone("Europe/Moscow")
+
+
+def to_moscow(value: datetime) -> datetime:
+    """Переводит наивное время из БД (UTC) в московское."""
+    return value.replace(tzinfo=timezone.utc).astimezone(moscow_tz())
+
+
+def moscow_today() -> date:
+    return datetime.now(moscow_tz()).date()
+
+
+def week_range(today: date) -> tuple[date, date]:
+    """С понедельника текущей недели по сегодняшний день включительно."""
+    return today - timedelta(days=today.weekday()), today
+
+
+def month_range(today: date) -> tuple[date, date]:
+    """С первого числа текущего месяца по сегодняшний день включительно."""
+    return today.replace(day=1), today
+
+
+def parse_date_range(text: str) -> tuple[date, date] | None:
+    """Разбирает период вида `01.10.2025-15.10.2025`."""
+    try:
+        start_str, end_str = text.replace(" ", "").split("-")
+        start = datetime.strptime(start_str, "%d.%m.%Y").date()
+        end = datetime.strptime(end_str, "%d.%m.%Y").date()
+    except ValueError:
+        return None
+    if start > end:
+        return None
+    return start, end
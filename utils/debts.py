@@ -0,0 +1,74 @@
+from collections import defaultdict
+from decimal import Decimal
+
+
+def shared_share(shared_total, member_count):
+    """Доля участника в общих тратах: они делятся поровну между всеми участниками счёта."""
+    return float(shared_total) / member_count if member_count else 0
+
+
+def member_balance(paid, personal_spent, shared_total, member_count):
+    """Баланс одного участника: внёс минус потратил лично минус доля общих трат."""
+    return float(paid) - float(personal_spent) - shared_share(shared_total, member_count)
+
+
+def settle_balances(member_ids, paid, personal_spent, shared_total):
+    """
+    Баланс участников по агрегатам журнала: сколько каждый внёс, сколько потратил лично
+    и общая сумма общих трат, которая делится поровну между участниками.
+    """
+    return {
+        uid: member_balance(paid.get(uid, 0), personal_spent.get(uid, 0), shared_total, len(member_ids))
+        for uid in member_ids
+    }
+
+
+def calculate_debts(wallet, incomes, expenses, members):
+    paid = defaultdict(Decimal)
+    for inc in incomes:
+        paid[inc.user_id] += inc.amount
+    personal_spent = defaultdict(Decimal)
+    shared_total = Decimal(0)
+    for exp in expenses:
+        if exp.is_shared:
+            shared_total += exp.amount
+        else:
+            personal_spent[exp.user_id] += exp.amount
+
+    return settle_balances([m.user_id for m in members], paid, personal_spent, shared_total)
+
+
+def debt_report(balance, members_dict):
+    creditors = sorted([(uid, amt) for uid, amt in balance.items() if amt > 0], key=lambda x: -x[1])
+    debtors = sorted([(uid, amt) for uid, amt in balance.items() if amt < 0], key=lambda x: x[1])
+    report = "\nИтоги по счету:\n"
+    for uid, amt in balance.items():
+        name = members_dict.get(uid, str(uid))
+        if amt > 0:
+            report += f"{name} (ID: {uid}) — переплатил {amt:.2f} ₽\n"
+        elif amt < 0:
+            report += f"{name} (ID: {uid}) — должен {-amt:.2f} ₽\n"
+        else:
+            report += f"{name} (ID: {uid}) — в нуле\n"
+    recs = []
+    i, j = 0, 0
+    while i < len(debtors) and j < len(creditors):
+        debtor_id, debtor_amt = debtors[i]
+        creditor_id, creditor_amt = creditors[j]
+        pay = min(-debtor_amt, creditor_amt)
+        if pay > 0:
+            d_name = members_dict.get(debtor_id, str(debtor_id))
+            c_name = members_dict.get(creditor_id, str(creditor_id))
+            recs.append(f"{d_name} должен {c_name} — {pay:.2f} ₽")
+            debtor_amt += pay
+            creditor_amt -= pay
+            debtors[i] = (debtor_id, debtor_amt)
+            creditors[j] = (creditor_id, creditor_amt)
+            if abs(debtor_amt) < 0.01:
+                i += 1
+            if abs(creditor_amt) < 0.01:
+                j += 1
+        else:
+            break
+    report += "\nКто кому сколько должен:\n" + "\n".join(recs)
+    return report
@@ -0,0 +1,94 @@
+import asyncio
+import logging
+import time
+from collections import defaultdict
+from dataclasses import dataclass, field
+
+from maxapi import Bot
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import async_sessionmaker
+
+from database.db import async_session_maker
+from database.models import WalletMember
+
+logger = logging.getLogger(__name__)
+
+# События за окно собираются в одну сводку на получателя.
+NOTIFY_WINDOW = 10
+# Сообщений в секунду: отправляются пачками такого размера, не чаще раза в секунду.
+NOTIFY_RATE = 20
+
+
+@dataclass
+class WalletEvents:
+    name: str
+    events: list[tuple[int, str]] = field(default_factory=list)
+
+
+class WalletNotifier:
+    """
+    Рассылка участникам счёта об общих тратах.
+
+    Хендлер только ставит событие в очередь. Раз в `window` секунд накопленные события
+    группируются: участники всех затронутых счетов читаются одним запросом, каждый
+    получатель получает одну сводку по всем своим счетам (без собственных действий),
+    а отправка идёт пачками по `rate` сообщений в секунду.
+    """
+
+    def __init__(self, session_maker: async_sessionmaker, window: float = NOTIFY_WINDOW, rate: int = NOTIFY_RATE):
+        self._session_maker = session_maker
+        self.window = window
+        self.rate = rate
+        self._pending: dict[int, WalletEvents] = {}
+
+    def notify(self, wallet_id: int, wallet_name: str, actor_id: int, text: str):
+        """Ставит событие счёта в очередь; автор события уведомление о нём не получит."""
+        self._pending.setdefault(wallet_id, WalletEvents(wallet_name)).events.append((actor_id, text))
+
+    async def run(self, bot: Bot):
+        while True:
+            await asyncio.sleep(self.window)
+            if not self._pending:
+                continue
+            try:
+                await self.flush(bot)
+            except Exception as e:
+                logger.exception("Ошибка рассылки уведомлений: %s", e)
+
+    async def flush(self, bot: Bot) -> int:
+        pending, self._pending = self._pending, {}
+        async with self._session_maker() as session:
+            rows = await session.execute(
+                select(WalletMember.wallet_id, WalletMember.user_id).where(WalletMember.wallet_id.in_(pending))
+            )
+            members = defaultdict(set)
+            for wallet_id, user_id in rows:
+                members[wallet_id].add(user_id)
+
+        digests: dict[int, list[str]] = defaultdict(list)
+        for wallet_id, wallet in pending.items():
+            for user_id in members[wallet_id]:
+                lines = [text for actor_id, text in wallet.events if actor_id != user_id]
+                if lines:
+                    digests[user_id].append(f"🔔 Общие траты в счёте «{wallet.name}»:\n" + "\n".join(lines))
+
+        await self._send(bot, {user_id: "\n\n".join(parts) for user_id, parts in digests.items()})
+        return len(digests)
+
+    async def _send(self, bot: Bot, messages: dict[int, str]):
+        recipients = list(messages)
+        for i in range(0, len(recipients), self.rate):
+            started = time.monotonic()
+            batch = recipients[i:i + self.rate]
+            results = await asyncio.gather(
+                *(bot.send_message(user_id=user_id, text=messages[user_id]) for user_id in batch),
+                return_exceptions=True
+            )
+            for user_id, result in zip(batch, results):
+                if isinstance(result, Exception):
+                    logger.warning("Не удалось отправить уведомление пользователю %s: %s", user_id, result)
+            if i + self.rate < len(recipients):
+                await asyncio.sleep(max(0.0, 1 - (time.monotonic() - started)))
+
+
+wallet_notifier = WalletNotifier(async_session_maker)
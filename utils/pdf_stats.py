@@ -1,3 +1,5 @@
+from functools import cache
+
 from reportlab.lib.pagesizes import A4
 from reportlab.pdfgen import canvas
 from reportlab.platypus import Table, TableStyle
@@ -5,66 +7,30 @@ from reportlab.lib import colors
 from reportlab.pdfbase.ttfonts import TTFont
 from reportlab.pdfbase import pdfmetrics
 
+from utils.debts import calculate_debts, debt_report
 
-def calculate_debts(wallet, incomes, expenses, members):
-    member_ids = [m.user_id for m in members]
-    paid = {uid: 0 for uid in member_ids}
-    for inc in incomes:
-        paid[inc.user_id] += float(inc.amount)
-    spent = {uid: 0 for uid in member_ids}
-    for exp in expenses:
-        if exp.is_shared:
-            share = float(exp.amount) / len(member_ids)
-            for uid in member_ids:
-                spent[uid] += share
-        else:
-            spent[exp.user_id] += float(exp.amount)
-
-    balance = {uid: paid[uid] - spent[uid] for uid in member_ids}
-    return balance
-
-
-def debt_report(balance, members_dict):
-    creditors = sorted([(uid, amt) for uid, amt in balance.items() if amt > 0], key=lambda x: -x[1])
-    debtors = sorted([(uid, amt) for uid, amt in balance.items() if amt < 0], key=lambda x: x[1])
-    report = "\nИтоги по счету:\n"
-    for uid, amt in balance.items():
-        name = members_dict.get(uid, str(uid))
-        if amt > 0:
-            report += f"{name} (ID: {uid}) — переплатил {amt:.2f} ₽\n"
-        elif amt < 0:
-            report += f"{name} (ID: {uid}) — должен {-amt:.2f} ₽\n"
-        else:
-            report += f"{name} (ID: {uid}) — в нуле\n"
-    recs = []
-    i, j = 0, 0
-    while i < len(debtors) and j < len(creditors):
-        debtor_id, debtor_amt = debtors[i]
-        creditor_id, creditor_amt = creditors[j]
-        pay = min(-debtor_amt, creditor_amt)
-        if pay > 0:
-            d_name = members_dict.get(debtor_id, str(debtor_id))
-            c_name = members_dict.get(creditor_id, str(creditor_id))
-            recs.append(f"{d_name} должен {c_name} — {pay:.2f} ₽")
-            debtor_amt += pay
-            creditor_amt -= pay
-            debtors[i] = (debtor_id, debtor_amt)
-            creditors[j] = (creditor_id, creditor_amt)
-            if abs(debtor_amt) < 0.01:
-                i += 1
-            if abs(creditor_amt) < 0.01:
-                j += 1
-        else:
-            break
-    report += "\nКто кому сколько должен:\n" + "\n".join(recs)
-    return report
 
-
-
-def generate_pdf(wallet, incomes, expenses, members, filename: str):
+@cache
+def register_fonts():
+    """Разбор TTF-файлов дорогой, поэтому шрифты регистрируются один раз на процесс."""
     pdfmetrics.registerFont(TTFont('RobotoBold', 'utils/fonts/Roboto-Bold.ttf'))
     pdfmetrics.registerFont(TTFont('Roboto', 'utils/fonts/Roboto-Regular.ttf'))
 
+
+def generate_pdf(wallet, incomes, expenses, members, filename: str, balance=None,
+                 income_total=None, expense_total=None):
+    """
+    Итоги за всё время (income_total, expense_total) передаются из дневных агрегатов, как и
+    balance: в incomes и expenses нет строк из архивных секций журнала.
+    """
+    register_fonts()
+    rows_income = sum(i.amount for i in incomes)
+    rows_expense = sum(e.amount for e in expenses)
+    if income_total is None:
+        income_total = rows_income
+    if expense_total is None:
+        expense_total = rows_expense
+
     c = canvas.Canvas(filename, pagesize=A4)
     width, height = A4
 
@@ -75,8 +41,11 @@ def generate_pdf(wallet, incomes, expenses, members, filename: str):
     c.setFont("Roboto", 12)
     c.drawString(50, height-90, f"Владелец: {wallet.owner_id}")
     c.drawString(50, height-110, f"Баланс: {wallet.balance} ₽")
-    c.drawString(50, height-130, f"Всего поступлений: {sum(i.amount for i in incomes)} ₽")
-    c.drawString(50, height-150, f"Всего трат: {sum(e.amount for e in expenses)} ₽")
+    c.drawString(50, height-130, f"Всего поступлений: {income_total} ₽")
+    c.drawString(50, height-150, f"Всего трат: {expense_total} ₽")
+    if (income_total, expense_total) != (rows_income, rows_expense):
+        c.setFont("Roboto", 9)
+        c.drawString(50, height-165, "В таблицах ниже только операции, оставшиеся в журнале: архивные месяцы не показаны.")
 
     c.setFont("RobotoBold", 14)
     c.drawString(50, height-180, "Пополнения:")
@@ -121,7 +90,8 @@ def generate_pdf(wallet, incomes, expenses, members, filename: str):
     table.drawOn(c, 50, 50)
 
     members_dict = {m.user_id: getattr(m.user, 'first_name', str(m.user_id)) for m in members}
-    balance = calculate_debts(wallet, incomes, expenses, members)
+    if balance is None:
+        balance = calculate_debts(wallet, incomes, expenses, members)
     report_text = debt_report(balance, members_dict)
     c.setFont("Roboto", 12)
     for idx, line in enumerate(report_text.splitlines()):